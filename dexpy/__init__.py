@@ -5,4 +5,4 @@ A python package for Design of Experiments (DOE).
 """
 
 __all__ = [ "alias", "ccd", "cox_effects", "design", "effects",
-            "factorial", "power", "samplers" ]
+            "factorial", "latin_hypercube", "power", "samplers" ]
@@ -1,70 +1,337 @@
 """Functions for detecting and listing aliases."""
 
 import numpy as np
+import pandas as pd
 import scipy.linalg
-from patsy import dmatrix
+import scipy.sparse
+from patsy import dmatrix, ModelDesc
+import collections.abc
 import math
 import logging
+import dexpy.design
+from dexpy.factorial import parse_generators, word_length_pattern
+from dexpy.factorial import defining_relation
 
 
-def alias_list(model, design):
+def alias_list(model, design, generators = None):
     """Returns a human-readable list of dependent model columns.
 
     This is done by solving AX=B, where X is the full rank model matrix,
     and B is all of the columns of the model matrix. The result is a matrix
     of coefficients which represent to what degree a given column is
-    collinear with another column.
+    collinear with another column. The columns in X are picked in model
+    order by :func:`estimable_columns`, and AX=B is solved from the QR
+    factorization of X.
 
     Usage:
       >>> design = dexpy.factorial.build_factorial(4, 8)
       >>> aliases, alias_coefs = dexpy.alias.alias_list("(A+B+C+D)**2)", design)
       >>> print(aliases)
       ['A:B = C:D', 'A:C = B:D', 'A:D = B:C']
+
+    :param model: A patsy formula for the model.
+    :param design: A pandas.DataFrame with the runs.
+    :param generators: The generators of a regular fraction built by
+                       :func:`dexpy.factorial.build_factorial`. If the model
+                       only has products of factors, the aliases then follow
+                       from the generators, see :func:`regular_alias_list`,
+                       and the model matrix isn't built.
+    :returns: A tuple of an :class:`AliasList` of the aliases and the
+              :class:`AliasMatrix` of coefficients.
     """
+    if generators is not None:
+        factor_count = len(generators) + len(design).bit_length() - 1
+        terms = _model_words(model, factor_count)
+        if terms is not None:
+            return _regular_aliases(terms, generators, factor_count)
+
     # use the square root of machine precision for testing for 0
     epsilon = math.sqrt(np.finfo(float).eps)
 
     logging.debug("model:\n%s", model)
-    model_matrix = dmatrix(model, design, return_type="dataframe")
-    logging.debug("model matrix (rhs):\n%s", model_matrix)
+    model_matrix = dmatrix(model, design)
+    terms = model_matrix.design_info.column_names
+    model_matrix = np.asarray(model_matrix)
 
     # there is no requirement that the model matrix is full rank
-    # so first remove linearly dependent columns using LU decomp
-    _, _, upper_matrix = scipy.linalg.lu(model_matrix)
-
-    row = 0
-    col = 0
-    # this array will be used to select columns for the full rank X matrix
-    column_unaliased = [False] * model_matrix.shape[1]
-    # iterate over diagonals of U, skipping columns with 0 in the diagonal
-    while row < model_matrix.shape[0] and col < model_matrix.shape[1]:
-        if abs(upper_matrix[row, col]) > epsilon:
-            column_unaliased[col] = True
-            row += 1
-        col += 1
-    logging.debug("estimating columns:\n%s", column_unaliased)
-
-    unaliased = model_matrix.loc[:, column_unaliased]
-    logging.debug("full rank matrix (lhs):\n%s", unaliased)
-
-    alias_coefs, _, _, _ = np.linalg.lstsq(unaliased, model_matrix)
-    logging.debug("alias matrix:\n%s", alias_coefs)
-    alias_list = []
-    for r in range(alias_coefs.shape[0]):
+    # so first pick the columns to estimate
+    estimated = estimable_columns(model_matrix, epsilon)
+    logging.debug("estimating columns:\n%s", estimated)
+
+    # the alias matrix A solves X_e A = X for the estimated columns X_e
+    q, r = scipy.linalg.qr(model_matrix[:, estimated], mode="economic")
+    alias_coefs = scipy.linalg.solve_triangular(r, np.dot(q.T, model_matrix))
+    # 0 means there is no correlation
+    alias_coefs[np.abs(alias_coefs) < epsilon] = 0
+    alias_matrix = AliasMatrix(scipy.sparse.csr_matrix(alias_coefs), terms,
+                               estimated)
+    logging.debug("alias matrix:\n%s", alias_matrix)
+    return AliasList(alias_matrix), alias_matrix
+
+
+def estimable_columns(model_matrix, tolerance, block_size = 64):
+    """Picks the model columns that can be estimated, in model order.
+
+    This is a QR factorization with column pivoting. The usual pivot is the
+    remaining column with the largest residual, but in a two-level design the
+    aliased columns all have the same norm, so rounding would decide whether
+    a main effect or its aliased interaction is estimated. Instead the pivot
+    is the next column in model order with a residual above tolerance, and
+    the columns below it are dropped as dependent. This keeps the earlier,
+    usually lower order, terms in the model.
+
+    The residuals are taken against the chosen columns a block at a time,
+    projecting twice to keep them orthogonal in floating point.
+
+    :param model_matrix: The model matrix, one column for each term.
+    :param tolerance: The smallest residual to keep a column, relative to
+                      its norm.
+    :param block_size: The number of columns to project at once.
+    :returns: A list of the estimable column indices. The number of them is
+              the rank of the model matrix.
+    """
+    model_matrix = np.asarray(model_matrix, dtype=float)
+    run_count, column_count = model_matrix.shape
+    basis = np.zeros((run_count, 0))
+    estimated = []
+    for start in range(0, column_count, block_size):
+        if len(estimated) == run_count:
+            break
+        block = model_matrix[:, start:start + block_size]
+        norms = np.linalg.norm(block, axis=0)
+        for _ in range(2):
+            block = block - np.dot(basis, np.dot(basis.T, block))
+
+        new_basis = []
+        for i in range(block.shape[1]):
+            residual = block[:, i]
+            for _ in range(2):
+                for vector in new_basis:
+                    residual = residual - np.dot(vector, residual) * vector
+            norm = np.linalg.norm(residual)
+            if norm > tolerance * norms[i] and len(estimated) < run_count:
+                estimated.append(start + i)
+                new_basis.append(residual / norm)
+        if new_basis:
+            basis = np.column_stack([basis] + new_basis)
+    return estimated
+
+
+class AliasMatrix:
+    """The alias matrix of a model, with labelled rows and columns.
+
+    Row i holds the coefficients of every model column regressed on the
+    estimated columns, for the i-th estimated column. Most are 0, so they are
+    kept in a scipy.sparse.csr_matrix. The matrix can be indexed like an
+    array, and converts to one with numpy.asarray.
+
+    :ivar coefs: The coefficients, a scipy.sparse.csr_matrix.
+    :ivar terms: The names of every model column.
+    :ivar estimated: The names of the estimated columns, one for each row.
+    """
+
+    def __init__(self, coefs, terms, estimated_columns):
+        self.coefs = coefs
+        self.terms = list(terms)
+        self.estimated_columns = np.asarray(estimated_columns, dtype=int)
+        self.estimated = [self.terms[c] for c in self.estimated_columns]
+
+    @property
+    def shape(self):
+        """The shape of the matrix, estimated columns by model columns."""
+        return self.coefs.shape
+
+    def __getitem__(self, key):
+        return self.coefs[key]
+
+    def __array__(self, dtype = None, copy = None):
+        if copy is False:
+            raise ValueError("An AliasMatrix can't be viewed as a dense "
+                             "array without a copy")
+        return self.toarray().astype(dtype, copy=False) if dtype \
+            else self.toarray()
+
+    def __repr__(self):
+        return repr(self.to_frame())
+
+    def toarray(self):
+        """Returns the coefficients as a dense numpy array."""
+        return self.coefs.toarray()
+
+    def to_frame(self):
+        """Returns the coefficients as a sparse, labelled pandas.DataFrame."""
+        # from_spmatrix fills with NaN in recent pandas, unaliased terms
+        # have to read as 0
+        frame = pd.DataFrame(self.toarray(), index=self.estimated,
+                             columns=self.terms)
+        return frame.astype(pd.SparseDtype(float, 0.0))
+
+    def aliased_rows(self):
+        """Returns the rows of the estimated columns that have aliases."""
+        # every row has a coefficient of 1 for its own column
+        return np.flatnonzero(np.diff(self.coefs.indptr) > 1)
+
+    def alias_string(self, row):
+        """Returns the aliases of an estimated column, e.g. 'A:B = C:D'."""
+        start, end = self.coefs.indptr[row:row + 2]
         alias_strings = []
-        for c in range(alias_coefs.shape[1]):
+        for c, coef in zip(self.coefs.indices[start:end],
+                           self.coefs.data[start:end]):
             # all columns are "aliased" with themselves, so don't show
-            if unaliased.columns[r] == model_matrix.columns[c]:
+            if c == self.estimated_columns[row]:
                 continue
-            # 0 means there is no correlation
-            if abs(alias_coefs[r, c]) < epsilon:
-                continue
-            if abs(alias_coefs[r, c] - 1.0) > epsilon:
-                alias_strings.append("{}*{}".format(alias_coefs[r, c],
-                                     model_matrix.columns[c]))
+            if abs(coef - 1.0) > math.sqrt(np.finfo(float).eps):
+                alias_strings.append("{}*{}".format(coef, self.terms[c]))
             else:
-                alias_strings.append(model_matrix.columns[c])
-        if alias_strings:
-            alias_list.append("{} = {}".format(unaliased.columns[r],
-                              " + ".join(alias_strings)))
-    return alias_list, alias_coefs
+                alias_strings.append(self.terms[c])
+        return "{} = {}".format(self.estimated[row], " + ".join(alias_strings))
+
+
+class AliasList(collections.abc.Sequence):
+    """The human-readable aliases of an :class:`AliasMatrix`.
+
+    This is a sequence of strings like 'A:B = C:D', one for each estimated
+    column with aliases. A string is only formatted when it is read, so
+    large models can be aliased without formatting every string.
+    """
+
+    def __init__(self, alias_matrix):
+        self.alias_matrix = alias_matrix
+        self.rows = alias_matrix.aliased_rows()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.alias_matrix.alias_string(self.rows[index])
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def regular_alias_list(model, generators, factor_count):
+    """Returns the alias list of a regular two-level fraction.
+
+    In a regular fraction every product of factors is aliased with its
+    product with each word of the defining relation, so the aliases follow
+    from the generators without any runs. A product of factors is reduced to
+    a product of the base factors by replacing each generated factor with its
+    generator, e.g. E with ABC for E=ABC, and the terms that reduce to the
+    same product are aliased. This takes milliseconds even for all of the
+    three factor interactions of 20 or more factors.
+
+    The result is the same as :func:`alias_list` for a design built by
+    :func:`dexpy.factorial.build_factorial` with the same generators.
+
+    Usage:
+      >>> aliases, alias_coefs = dexpy.alias.regular_alias_list(
+      ...     "(X1+X2+X3+X4)**2", ["D=ABC"], 4)
+      >>> print(aliases)
+      ['X1:X2 = X3:X4', 'X1:X3 = X2:X4', 'X1:X4 = X2:X3']
+
+    :param model: A patsy formula with only products of the factors, e.g.
+                  "(X1+X2+X3+X4)**2".
+    :param generators: The generators of the fraction, e.g. ``["D=ABC"]``.
+    :param factor_count: The number of factors in the fraction.
+    :returns: The alias list and the alias matrix, as :func:`alias_list`.
+    """
+    terms = _model_words(model, factor_count)
+    if terms is None:
+        raise ValueError("Only products of the factors can be aliased from "
+                         "the generators, not '{}'".format(model))
+    return _regular_aliases(terms, generators, factor_count)
+
+
+def defining_words(generators, factor_count):
+    """Returns the words of the defining relation of a regular fraction.
+
+    Usage:
+      >>> dexpy.alias.defining_words(["F=ABCD", "G=ABDE"], 7)
+      ['X3:X5:X6:X7', 'X1:X2:X3:X4:X6', 'X1:X2:X4:X5:X7']
+
+    :param generators: The generators of the fraction, e.g. ``["D=ABC"]``.
+    :param factor_count: The number of factors in the fraction.
+    :returns: The words as model terms, shortest first.
+    """
+    relation = defining_relation(_generator_words(generators, factor_count))
+    names = dexpy.design.get_factor_names(factor_count)
+    words = []
+    for word in sorted(int(w) for w in relation):
+        letters = [i for i in range(factor_count) if word >> i & 1]
+        words.append((len(letters), letters))
+    return [":".join(names[i] for i in letters)
+            for _, letters in sorted(words)]
+
+
+def resolution(generators, factor_count):
+    """Returns the resolution of a regular fraction.
+
+    The resolution is the length of the shortest word in the defining
+    relation, e.g. no main effect is aliased with a two factor interaction in
+    a resolution IV design.
+
+    :param generators: The generators of the fraction, e.g. ``["D=ABC"]``.
+    :param factor_count: The number of factors in the fraction.
+    :returns: The resolution, or None for a full factorial.
+    """
+    words = _generator_words(generators, factor_count)
+    if not words:
+        return None
+    pattern = word_length_pattern(words, factor_count)
+    return int(np.flatnonzero(pattern)[0])
+
+
+def _generator_words(generators, factor_count):
+    """Returns the defining words of each generator as bitmasks."""
+    full_factor_count = factor_count - len(generators)
+    words = parse_generators(generators, full_factor_count, factor_count)
+    return [word | 1 << (full_factor_count + i)
+            for i, word in enumerate(words)]
+
+
+def _model_words(model, factor_count):
+    """Returns the name and word of each model column in order.
+
+    :returns: A list of (name, word) pairs, or None if a term isn't a product
+              of the factors.
+    """
+    factor_ids = {name: i for i, name in
+                  enumerate(dexpy.design.get_factor_names(factor_count))}
+    terms = []
+    for term in ModelDesc.from_formula(model).rhs_termlist:
+        word = 0
+        for factor in term.factors:
+            if getattr(factor, "code", None) not in factor_ids:
+                return None
+            word |= 1 << factor_ids[factor.code]
+        terms.append((term.name(), word))
+    return terms
+
+
+def _regular_aliases(terms, generators, factor_count):
+    """Groups the model columns of a regular fraction into alias chains."""
+    full_factor_count = factor_count - len(generators)
+    names = [name for name, _ in terms]
+    keys = np.array([word for _, word in terms], dtype=np.uint64)
+    # replace each generated factor with its generator
+    for i, word in enumerate(_generator_words(generators, factor_count)):
+        generated = (keys >> np.uint64(full_factor_count + i)) & np.uint64(1)
+        keys[generated == 1] ^= np.uint64(word)
+
+    # the first column of each chain is estimated, as estimable_columns would
+    # pick
+    _, first, chains = np.unique(keys, return_index=True, return_inverse=True)
+    rows = np.empty(len(first), dtype=int)
+    rows[np.argsort(first)] = np.arange(len(first))
+    alias_coefs = scipy.sparse.csr_matrix(
+        (np.ones(len(names)), (rows[chains], np.arange(len(names)))),
+        shape=(len(first), len(names)))
+    alias_matrix = AliasMatrix(alias_coefs, names, np.sort(first))
+    return AliasList(alias_matrix), alias_matrix
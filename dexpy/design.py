@@ -20,9 +20,19 @@ def get_var_name(var_id):
 
 
 def get_var_id(var_name):
-    """Returns the index of a variable name."""
-    #TODO: need to handle var names with ' or "
-    return valid_vars.index(var_name)
+    """Returns the index of a variable name.
+
+    This is the inverse of :func:`get_var_name`, so A' and A" are the 26th
+    and 51st variables.
+    """
+    var_id = valid_vars.index(var_name[0])
+    if var_name[1:] == "'":
+        var_id += len(valid_vars)
+    elif var_name[1:] == '"':
+        var_id += len(valid_vars) * 2
+    elif var_name[1:]:
+        raise ValueError("Didn't recognize variable name '{}'!".format(var_name))
+    return var_id
 
 
 def load_file(file_path):
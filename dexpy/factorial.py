@@ -1,23 +1,97 @@
 """Functions to build factorial designs."""
 
-import itertools
+import json
+import logging
+import os
+import re
+import numpy as np
 import pandas as pd
 import dexpy.design as design
+from dexpy.samplers import CHUNK_SIZE
+
+# where searched generators are kept between sessions
+GENERATOR_CACHE = os.path.join(os.path.expanduser("~"), ".dexpy",
+                               "generators.json")
+
+# the section of the cache for generators from the beam search, which are not
+# guaranteed to be minimum aberration
+BEAM_SEARCH = "beam_search"
 
 
 def build_full_factorial(factor_count):
     """Builds a full 2^K factorial design.
 
     The resulting design will contain every combination of -1 and +1 for the
-    number of factors given.
+    number of factors given. The first factor changes slowest.
+
+    :param factor_count: The number of factors to build for.
+    :type factor_count: int
+    :returns: A (2^K, K) numpy array of int64.
     """
-    factor_data = []
-    for run in itertools.product([-1, 1], repeat=factor_count):
-        factor_data.append(list(run))
-    return factor_data
+    # the signs are built as int8, but user arithmetic on them would overflow
+    return _sign_matrix(0, 2 ** factor_count, factor_count).astype(np.int64)
+
 
+def iter_full_factorial(factor_count, chunk_size = CHUNK_SIZE):
+    """Builds a full 2^K factorial design, a chunk of runs at a time.
+
+    This yields the same runs as :func:`build_full_factorial` without holding
+    more than one chunk in memory, for run counts too large to build at once.
+
+    :param factor_count: The number of factors to build for.
+    :type factor_count: int
+    :param chunk_size: The most runs in each chunk.
+    :type chunk_size: int
+    :returns: An iterator over int8 arrays of up to chunk_size runs. Sums
+              and products of int8 columns overflow past 127, so convert
+              them to a wider type before doing arithmetic with them.
+    """
+    run_count = 2 ** factor_count
+    for start in range(0, run_count, chunk_size):
+        yield _sign_matrix(start, min(start + chunk_size, run_count),
+                           factor_count)
 
-def build_factorial(factor_count, run_count):
+
+def _sign_matrix(start, stop, factor_count, words = None):
+    """Returns runs start to stop of a full factorial in standard order.
+
+    Run r of the design is the binary representation of r, with the first
+    factor in the most significant bit and a 0 bit at the low level.
+
+    :param words: Builds a column for each word instead of each factor, see
+                  :func:`parse_generators`. The column is the product of the
+                  factors in the word, which is +1 when the number of factors
+                  at their low level is even.
+    """
+    if words is None:
+        words = [1 << i for i in range(factor_count)]
+
+    runs = np.arange(start, stop, dtype=np.uint64)
+    signs = np.empty((len(runs), len(words)), dtype=np.int8)
+    for column, word in enumerate(words):
+        # reverse the word to match the bit order of the runs
+        mask = sum(1 << (factor_count - 1 - i)
+                   for i in range(factor_count) if word >> i & 1)
+        low = (mask & -mask).bit_length() - 1
+        bits = (runs & np.uint64(mask)) >> np.uint64(low)
+
+        # fold the bits in the mask onto the lowest to get their parity
+        shift = 1
+        while shift < mask.bit_length() - low:
+            shift *= 2
+        while shift > 1:
+            shift //= 2
+            bits ^= bits >> np.uint64(shift)
+
+        odd_word = bin(word).count("1") % 2
+        signs[:, column] = (bits & np.uint64(1)) ^ np.uint64(1 - odd_word)
+    signs *= 2
+    signs -= 1
+    return signs
+
+
+def build_factorial(factor_count, run_count, generators = None,
+                    cache_path = GENERATOR_CACHE):
     """Builds a regular two-level design based on a number of factors and runs.
 
     Full two-level factorial designs may be run for up to 9 factors. These
@@ -31,11 +105,31 @@ def build_factorial(factor_count, run_count):
     :ref:`alias list<alias-list>` method to see what terms are estimable in
     the resulting design.
 
+    Minimum aberration generators are stored for up to 21 factors and 512
+    runs, other fractions are searched for with
+    :func:`minimum_aberration_generators`. The searched fraction is always
+    resolution III or higher, and resolution IV or higher when there are at
+    most run_count / 2 factors (with more there is no resolution IV design),
+    but it may not have the highest resolution or the least aberration.
+    Searched generators are saved to **cache_path**, so building the same
+    fraction again doesn't repeat the search. The generators can also be passed
+    in, e.g. ``["E=ABC", "F=BCD"]`` for a 2^(6-2) design. Factors after Z are named
+    A', B', ... and then A", B", ... as in :func:`dexpy.design.get_var_name`.
+
     :param factor_count: The number of factors to build for.
     :type factor_count: int
     :param run_count: The number of runs in the resulting design. Must be a power of 2.
     :type run_count: int
-    :returns: A pandas.DataFrame object containing the requested design.
+    :param generators: The generators of the fraction, one for each factor
+                       after the first log2(run_count). Defaults to the stored
+                       minimum aberration generators.
+    :type generators: list of str
+    :param cache_path: The JSON file searched generators are read from and
+                       saved to, ~/.dexpy/generators.json by default. Use None
+                       to always search and never write a file.
+    :type cache_path: str
+    :returns: A pandas.DataFrame object containing the requested design, with
+              int64 columns of -1 and 1.
     """
     # store minimum aberration generators for factors from 3 to max_factors
     # these are from Design-Expert
@@ -61,28 +155,403 @@ def build_factorial(factor_count, run_count):
         21: {32: ["F=ABC", "G=ABD", "H=ACD", "J=BCD", "K=ABCD", "L=ABE", "M=ACE", "N=BCE", "O=ABCE", "P=ADE", "Q=BDE", "R=ABDE", "S=CDE", "T=ACDE", "U=BCDE", "V=ABCDE"], 64: ["G=ABC", "H=ABD", "J=ACD", "K=BCD", "L=ABE", "M=ACE", "N=BCE", "O=ADE", "P=ABF", "Q=ADF", "R=BDF", "S=AEF", "T=CEF", "U=DEF", "V=BCDEF"], 128: ["H=ABCD", "J=ABCE", "K=ABDE", "L=ACDE", "M=ABCF", "N=ABDF", "O=ACEF", "P=ADEF", "Q=ACDG", "R=ABEG", "S=BCDEG", "T=CDFG", "U=BEFG", "V=ABCDEFG"], 256: ["J=ABCDE", "K=ABCDF", "L=ABCEF", "M=ABDEF", "N=ABCDG", "O=ABEFG", "P=ACDEFG", "Q=ACDEFH", "R=BCDEFH", "S=BCEGH", "T=ABDEGH", "U=ABCFGH", "V=BDFGH"], 512: ["K=ABCDE", "L=ABCFG", "M=ABDFH", "N=ACEGH", "O=ADEFGH", "P=BCEFJ", "Q=ABDEGJ", "R=BDFGJ", "S=ACFHJ", "T=BCEGHJ", "U=CDFGHJ", "V=DEHJ"]} # noqa
     }
 
-    if run_count == 2 ** factor_count:
-        generators = []
-    else:
-        generators = generator_list[factor_count][run_count]
-    fractional_factors = len(generators)
+    full_factor_count = int(run_count).bit_length() - 1
+    if run_count < 2 or run_count != 2 ** full_factor_count:
+        raise ValueError("The run count must be a power of 2, not "
+                         "{}".format(run_count))
+    if full_factor_count > factor_count:
+        raise ValueError("A {} factor design can have at most {} runs, not "
+                         "{}".format(factor_count, 2 ** factor_count, run_count))
 
-    full_factor_count = factor_count - fractional_factors
-    full_factor_names = design.get_factor_names(full_factor_count)
-    factor_data = pd.DataFrame(build_full_factorial(full_factor_count),
-                               columns=full_factor_names)
+    if generators is None:
+        if full_factor_count == factor_count:
+            generators = []
+        elif run_count in generator_list.get(factor_count, {}):
+            generators = generator_list[factor_count][run_count]
+        else:
+            generators = minimum_aberration_generators(
+                factor_count, run_count, cache_path=cache_path)
 
-    if full_factor_count == factor_count:
-        return factor_data
+    words = [1 << i for i in range(full_factor_count)]
+    words.extend(parse_generators(generators, full_factor_count,
+                                  factor_count))
+    # the signs are built as int8, but user arithmetic on them would overflow
+    signs = _sign_matrix(0, run_count, full_factor_count, words)
+    return pd.DataFrame(signs.astype(np.int64),
+                        columns=design.get_factor_names(factor_count))
 
+
+def parse_generators(generators, full_factor_count, factor_count):
+    """Converts generator strings into words.
+
+    A word is an integer bitmask with bit i set if factor i is in it, so the
+    generator "D=ABC" for a 2^(4-1) design is the word 0b111.
+
+    :param generators: The generators, e.g. ``["E=ABC", "F=BCD"]``.
+    :param full_factor_count: The number of factors in the full factorial the
+                              generators are built from.
+    :param factor_count: The total number of factors.
+    :returns: A list of the words of the generated factors, in factor order.
+    """
+    if len(generators) != factor_count - full_factor_count:
+        raise ValueError("{} factors in {} runs need {} generators, not "
+                         "{}".format(factor_count, 2 ** full_factor_count,
+                                     factor_count - full_factor_count,
+                                     len(generators)))
+
+    words = {}
     for gen in generators:
-        lhs, rhs = gen.split("=")
-        lhs = "X" + str(design.get_var_id(lhs)+1 ) # rename to X1/X2/etc
-        cols = []
-        for var in rhs:
-            cols.append(design.get_var_id(var))
+        lhs, rhs = gen.replace(" ", "").split("=")
+        factor = design.get_var_id(lhs)
+        if factor < full_factor_count or factor >= factor_count:
+            raise ValueError("Generator '{}' must define one of the last {} "
+                             "factors".format(gen, len(generators)))
+        if factor in words:
+            raise ValueError("Factor {} is generated twice".format(lhs))
+
+        names = re.findall("[A-Z]['\"]?", rhs)
+        if not names or "".join(names) != rhs:
+            raise ValueError("Didn't recognize generator '{}'!".format(gen))
+        word = 0
+        for name in names:
+            var_id = design.get_var_id(name)
+            if var_id >= full_factor_count:
+                raise ValueError("Generator '{}' must only use the first {} "
+                                 "factors".format(gen, full_factor_count))
+            word ^= 1 << var_id
+        words[factor] = word
+
+    return [words[factor] for factor in sorted(words)]
+
+
+def defining_relation(words):
+    """Returns every word in the defining contrast subgroup of a fraction.
+
+    The subgroup is all products of the defining words, which is built by
+    XORing each new word with every word found so far.
+
+    :param words: The defining words of the fraction as bitmasks, e.g.
+                  0b1111 for I=ABCD. These are the generator words of
+                  :func:`parse_generators` with the generated factor's bit
+                  set.
+    :returns: A numpy array of uint64 with the 2^p - 1 words of the subgroup,
+              excluding the identity.
+    """
+    subgroup = np.zeros(1, dtype=np.uint64)
+    for word in words:
+        subgroup = np.concatenate([subgroup, subgroup ^ np.uint64(word)])
+    return subgroup[1:]
+
+
+def word_length_pattern(words, factor_count):
+    """Returns the word length pattern of a regular fraction.
+
+    One fraction has less aberration than another if it has fewer words of
+    the shortest length where their patterns differ, and the fraction with
+    the least is the minimum aberration design.
+
+    :param words: The defining words of the fraction, see
+                  :func:`defining_relation`.
+    :param factor_count: The number of factors in the fraction.
+    :returns: A numpy array of length factor_count + 1 where item i is the
+              number of words of length i. The resolution of the fraction is
+              the first nonzero item.
+    """
+    lengths = _popcount(defining_relation(words))
+    return np.bincount(lengths, minlength=factor_count + 1)
+
+
+def minimum_aberration_generators(factor_count, run_count, beam_width = 10,
+                                  cache_path = GENERATOR_CACHE):
+    """Searches for the generators of a low aberration fraction.
+
+    The generated factors are added one at a time, each set to an interaction
+    of the first log2(run_count) factors. Every partial design is scored by
+    its word length pattern, which only needs the lengths of the new words
+    when a factor is added, and the beam_width best are extended. Isomorphic
+    designs, where the factors can be relabelled to get the same defining
+    relation, would fill the beam with copies, so designs with the same word
+    length pattern and the same word lengths for each factor are only kept
+    if there is room left in the beam. Designs with the same generator
+    columns are the same design and are always dropped.
+
+    The beam makes this a heuristic: it is exact only while the beam holds
+    every distinct design at each stage, and otherwise may not find the
+    minimum aberration fraction. Every generator is an interaction of two or
+    more factors, so the fraction is at least resolution III, and it is at
+    least resolution IV when there are at most run_count / 2 factors, which
+    always have a resolution IV design. If the search only finds resolution
+    III for those, it is repeated over the even designs, where every
+    generator is an odd interaction, as any three of those columns multiply
+    to another odd column rather than I.
+
+    The search doesn't enumerate the 2^(factor_count - log2(run_count)) words
+    in the defining relation of each design, so large fractions can be
+    searched. Searched generators are saved as beam search results in a JSON
+    file, ~/.dexpy/generators.json by default, so each combination of
+    factors, runs and beam width is only searched once.
+
+    :param factor_count: The number of factors in the fraction, at most 64
+                         and less than the run count.
+    :type factor_count: int
+    :param run_count: The number of runs, a power of 2.
+    :type run_count: int
+    :param beam_width: The number of partial designs extended at each stage.
+    :type beam_width: int
+    :param cache_path: The file to keep searched generators in, or None to
+                       always search.
+    :type cache_path: str
+    :returns: A list of generator strings for :func:`build_factorial`.
+    """
+    full_factor_count = int(run_count).bit_length() - 1
+    if run_count < 2 or run_count != 2 ** full_factor_count:
+        raise ValueError("The run count must be a power of 2, not "
+                         "{}".format(run_count))
+    if factor_count >= run_count or factor_count > 64:
+        raise ValueError("A {} run fraction can have at most {} factors, not "
+                         "{}".format(run_count, min(run_count - 1, 64),
+                                     factor_count))
+    if factor_count <= full_factor_count:
+        return []
+
+    key = "{},{},{}".format(factor_count, run_count, beam_width)
+    # only the beam search section is ours, the rest is saved back unchanged
+    cache = _load_generator_cache(cache_path)
+    searched = cache.setdefault(BEAM_SEARCH, {})
+    if key in searched:
+        return searched[key]
+
+    # a column must be an interaction of 2 or more factors to keep the
+    # resolution at III or above
+    candidates = np.arange(3, run_count)
+    candidates = candidates[_popcount(candidates.astype(np.uint64)) >= 2]
+    columns, pattern = _beam_search(full_factor_count, factor_count,
+                                    candidates, beam_width)
+    if pattern[3] and 2 * factor_count <= run_count:
+        odd = candidates[_popcount(candidates.astype(np.uint64)) % 2 == 1]
+        columns, pattern = _beam_search(full_factor_count, factor_count, odd,
+                                        beam_width)
+
+    names = [design.get_var_name(i) for i in range(factor_count)]
+    generators = []
+    for i, column in enumerate(columns):
+        generators.append("{}={}".format(
+            names[full_factor_count + i],
+            "".join(names[j] for j in range(full_factor_count)
+                    if column >> j & 1)))
+
+    searched[key] = generators
+    _save_generator_cache(cache_path, cache)
+    return generators
+
+
+def _beam_search(full_factor_count, factor_count, candidates, beam_width):
+    """Runs the search of :func:`minimum_aberration_generators`.
+
+    :param candidates: The columns the generated factors can be set to.
+    :returns: A tuple of the generator columns of the best design and its
+              word length pattern.
+    """
+    search = _AberrationSearch(full_factor_count, factor_count)
+
+    # each design is its generator columns, its histograms, its letter
+    # pattern and its word length pattern
+    size = factor_count + 1
+    designs = [((), search.start(), np.zeros((factor_count, size), dtype=int),
+                np.zeros(size, dtype=int))]
+    for _ in range(full_factor_count, factor_count):
+        extensions = []
+        for parent, (columns, _, _, pattern) in enumerate(designs):
+            unused = candidates[~np.isin(candidates, columns)]
+            letters = search.new_letters(designs[parent][1])[unused]
+            # every new word has the new factor
+            new_patterns = letters[:, -1]
+            valid = ~np.any(new_patterns[:, :3], axis=1)
+            new_patterns = new_patterns[valid] + pattern
+            for column, new_pattern, new_letters in zip(
+                    unused[valid], new_patterns, letters[valid]):
+                extensions.append((tuple(new_pattern[3:]), parent,
+                                   int(column), new_pattern, new_letters))
+        if not extensions:
+            raise ValueError("There is no resolution III fraction with {} "
+                             "factors in {} runs".format(factor_count,
+                                                         2 ** full_factor_count))
+
+        extensions.sort(key=lambda extension: extension[:3])
+        parents = designs
+        kept = []
+        maybe_isomorphic = []
+        column_sets = set()
+        invariants = set()
+        for order, parent, column, pattern, new_letters in extensions:
+            columns = parents[parent][0] + (column,)
+            column_set = frozenset(columns)
+            if column_set in column_sets:
+                continue
+            column_sets.add(column_set)
+
+            letters = parents[parent][2].copy()
+            letters[:len(new_letters)] += new_letters
+            invariant = (order, tuple(sorted(map(tuple, letters))))
+            if invariant in invariants:
+                maybe_isomorphic.append((parent, columns, letters, pattern))
+                continue
+            invariants.add(invariant)
+            kept.append((parent, columns, letters, pattern))
+            if len(kept) == beam_width:
+                break
+        kept.extend(maybe_isomorphic[:beam_width - len(kept)])
+
+        designs = [(columns,
+                    search.add_factor(parents[parent][1], columns[-1]),
+                    letters, pattern)
+                   for parent, columns, letters, pattern in kept]
+
+    return designs[0][0], designs[0][3]
+
+
+def _popcount(words):
+    """Returns the number of set bits in each item of a uint64 array."""
+    # add up the bits in pairs, then nibbles, then bytes, then sum the bytes
+    # with a multiply
+    words = np.asarray(words, dtype=np.uint64)
+    counts = words - ((words >> np.uint64(1)) &
+                      np.uint64(0x5555555555555555))
+    pairs = np.uint64(0x3333333333333333)
+    counts = (counts & pairs) + ((counts >> np.uint64(2)) & pairs)
+    counts += counts >> np.uint64(4)
+    counts &= np.uint64(0x0f0f0f0f0f0f0f0f)
+    counts *= np.uint64(0x0101010101010101)
+    counts >>= np.uint64(56)
+    return counts.astype(np.intp)
+
+
+class _AberrationSearch:
+    """Tracks the defining relation of partial designs in the search.
+
+    A word of the defining relation is split into its base factors b, the
+    first log2(run_count), and its number of generated factors l. Adding a
+    factor generated by column c adds the word of c and the new factor times
+    every word already there, which has base factors b XOR c and l + 1
+    generated factors. So instead of the 2^p words themselves, a design keeps
+    a histogram of its words by b and l, and one more for each generated
+    factor counting the words that contain it. Their size doesn't grow with
+    the defining relation.
+
+    The new words for every column c at once are then XOR convolutions of
+    the histograms, which are products after a Walsh-Hadamard transform.
+    """
+
+    def __init__(self, full_factor_count, factor_count):
+        self.full_factor_count = full_factor_count
+        self.factor_count = factor_count
+        self.run_count = 1 << full_factor_count
+        self.generated_size = factor_count - full_factor_count + 1
+
+        # the transforms of the number of columns at each distance from 0,
+        # first in total and then with each base factor
+        bases = np.arange(self.run_count)
+        base_lengths = _popcount(bases.astype(np.uint64))
+        at_distance = np.equal.outer(base_lengths,
+                                     np.arange(full_factor_count + 1))
+        kernels = [at_distance]
+        for factor in range(full_factor_count):
+            kernels.append(at_distance * (bases >> factor & 1)[:, np.newaxis])
+        self.kernels = _walsh_hadamard(np.hstack(kernels)).reshape(
+            self.run_count, full_factor_count + 1, full_factor_count + 1)
+
+    def start(self):
+        """Returns the histograms of the full factorial, just the identity.
+
+        The first histogram counts every word, the rest count the words with
+        each generated factor.
+        """
+        histograms = np.zeros((1, self.run_count, self.generated_size))
+        histograms[0, 0, 0] = 1
+        return histograms
+
+    def add_factor(self, histograms, column):
+        """Returns the histograms after adding a factor generated by column."""
+        new_words = np.zeros_like(histograms)
+        new_words[:, :, 1:] = histograms[:, np.arange(self.run_count) ^ column,
+                                         :-1]
+        return np.concatenate([histograms + new_words, new_words[:1]])
+
+    def new_letters(self, histograms):
+        """Counts the new words with each factor for every column.
+
+        :returns: A (run_count, factors, factor_count + 1) array of the
+                  lengths of the new words with each base factor, each
+                  generated factor and the new factor, for a new factor
+                  generated by each column. The new factor is in every new
+                  word, so its counts are the new part of the word length
+                  pattern.
+        """
+        generated_count = len(histograms) - 1
+        transformed = _walsh_hadamard(
+            np.hstack(histograms)).reshape(self.run_count, -1,
+                                           self.generated_size)
+
+        # the histogram and kernel for each factor's words
+        sources = [0] * self.full_factor_count + \
+            list(range(1, generated_count + 1)) + [0]
+        kernels = list(range(1, self.full_factor_count + 1)) + \
+            [0] * (generated_count + 1)
+        transformed = transformed[:, sources]
+        kernels = self.kernels[:, kernels]
+
+        counts = np.zeros((self.run_count, len(sources),
+                           self.factor_count + 1))
+        for distance in range(self.full_factor_count + 1):
+            # the +1 is for the new factor
+            width = min(self.generated_size, self.factor_count - distance)
+            counts[:, :, distance + 1:distance + 1 + width] += \
+                transformed[:, :, :width] * kernels[:, :, distance, np.newaxis]
+        counts = _walsh_hadamard(counts.reshape(self.run_count, -1))
+        return np.rint(counts / self.run_count).astype(int).reshape(
+            self.run_count, len(sources), self.factor_count + 1)
+
+
+def _walsh_hadamard(values):
+    """Returns the Walsh-Hadamard transform of the rows of an array.
+
+    The transform turns XOR convolution into multiplication, and applying it
+    twice multiplies by the number of rows, which must be a power of 2.
+    """
+    transformed = np.array(values, dtype=float)
+    rows = len(transformed)
+    half = 1
+    while half < rows:
+        pairs = transformed.reshape(rows // (2 * half), 2, half, -1)
+        first = pairs[:, 0] + pairs[:, 1]
+        pairs[:, 1] = pairs[:, 0] - pairs[:, 1]
+        pairs[:, 0] = first
+        half *= 2
+    return transformed
+
+
+def _load_generator_cache(cache_path):
+    """Returns the searched generators saved in a file, if there are any."""
+    if cache_path is None:
+        return {}
+    try:
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
 
-        generator_column = factor_data.iloc[:, cols].product(axis=1).rename(lhs)
-        factor_data = factor_data.join(generator_column)
 
-    return factor_data
+def _save_generator_cache(cache_path, cache):
+    """Saves searched generators, replacing the file in one step."""
+    if cache_path is None:
+        return
+    try:
+        directory = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(temp_path, "w") as cache_file:
+            json.dump(cache, cache_file, indent=1, sort_keys=True)
+        os.replace(temp_path, cache_path)
+    except OSError as error:
+        logging.warning("couldn't save generators to {}: {}".format(
+            cache_path, error))
@@ -0,0 +1,192 @@
+"""Functions for building space-filling Latin hypercube designs."""
+
+import dexpy.design as design
+from dexpy.samplers import check_random_state, spawn_seeds
+import pandas as pd
+import numpy as np
+import multiprocessing
+
+
+def build_latin_hypercube(factor_count, run_count, p = 50, iterations = None,
+                          candidates = 50, n_starts = 1, n_jobs = 1,
+                          random_state = None):
+    r"""Builds a space-filling Latin hypercube design.
+
+    Latin hypercube designs are used for computer experiments, where there is
+    no random error and the response is fit with a flexible model such as a
+    Gaussian process. Each factor range is split into run_count equal slices,
+    and each run is at the middle of a different slice for every factor, so
+    every factor has run_count distinct levels.
+
+    The runs are spread through the design region by minimizing the
+    :math:`\phi_p` criterion of Morris and Mitchell 1995
+    :cite:`MorrisMitchell1995`,
+
+    .. math:: \phi_p = \left(\sum_{i<j} d_{ij}^{-p}\right)^{1/p}
+
+    where :math:`d_{ij}` is the distance between runs i and j. As p grows
+    this ranks designs by their smallest distance between runs, so a large p
+    gives a maximin design.
+
+    The criterion is improved by swapping the levels of two runs within a
+    column, which keeps the Latin hypercube structure. Each iteration picks a
+    column, scores **candidates** random swaps in it and makes the best one if
+    it helps. A swap only changes the distances from the two runs involved, so
+    each candidate is scored in O(run_count) time.
+
+    :param factor_count: The number of factors to build for.
+    :type factor_count: integer
+    :param run_count: The number of runs in the design.
+    :type run_count: integer
+    :param p: The exponent of the distances in the criterion.
+    :type p: float
+    :param iterations: The most column swaps to try, defaults to 100 per
+                       factor per run. The search stops early once 10 columns
+                       in a row give no improvement.
+    :type iterations: integer
+    :param candidates: The number of random swaps scored in each iteration.
+    :type candidates: integer
+    :param n_starts: The number of random starting designs to optimize, the
+                     best design is returned.
+    :type n_starts: integer
+    :param n_jobs: The number of processes to run the starts in. Use None to
+                   use one process per cpu.
+    :type n_jobs: integer
+    :param random_state: The seed for the starting designs, see
+                         :func:`check_random_state
+                         <dexpy.samplers.check_random_state>`.
+    :returns: A pandas.DataFrame with the runs in coded units (-1 to 1).
+    """
+    if run_count < 2:
+        raise ValueError("A Latin hypercube needs at least 2 runs, not "
+                         "{}".format(run_count))
+    if iterations is None:
+        iterations = 100 * factor_count * run_count
+
+    if n_starts == 1:
+        seeds = [random_state]
+    else:
+        seeds = spawn_seeds(random_state, n_starts)
+    starts = [(factor_count, run_count, p, iterations, candidates, seed)
+              for seed in seeds]
+
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or n_starts == 1:
+        results = [latin_hypercube_start(*start) for start in starts]
+    else:
+        pool = multiprocessing.Pool(min(n_jobs, n_starts))
+        try:
+            results = pool.starmap(latin_hypercube_start, starts)
+        finally:
+            pool.close()
+            pool.join()
+
+    best = int(np.argmin([phi for _, phi in results]))
+    return pd.DataFrame(results[best][0],
+                        columns=design.get_factor_names(factor_count))
+
+
+def latin_hypercube_start(factor_count, run_count, p, iterations, candidates,
+                          seed = None):
+    """Optimizes one random Latin hypercube.
+
+    :returns: A tuple of the runs and their :math:`\\phi_p`.
+    """
+    rng = check_random_state(seed)
+
+    # the middle of each slice of the coded range
+    levels = (2 * np.arange(run_count) + 1) / run_count - 1
+    points = np.column_stack([rng.permutation(levels)
+                              for _ in range(factor_count)])
+
+    # only the sum of d^-p is needed, it is minimized by the same designs
+    squared = _squared_distances(points)
+    terms = _terms(squared, p)
+    total = np.sum(terms)
+
+    rows = np.arange(candidates)
+    stall = 0
+    for _ in range(iterations):
+        column = _integers(rng, 0, factor_count, None)
+        first = _integers(rng, 0, run_count, candidates)
+        second = (first + _integers(rng, 1, run_count, candidates)) % run_count
+
+        # the change in the squared distances from the first run of each pair
+        # to every run, the second run's change is the opposite
+        values = points[:, column]
+        change = ((values[second, np.newaxis] - values) ** 2 -
+                  (values[first, np.newaxis] - values) ** 2)
+        new_first = _terms(squared[first] + change, p)
+        new_second = _terms(squared[second] - change, p)
+        # a swap doesn't change the distance between the pair
+        new_first[rows, first] = 0
+        new_first[rows, second] = terms[first, second]
+        new_second[rows, second] = 0
+        new_second[rows, first] = terms[first, second]
+
+        improvement = (np.sum(terms[first], axis=1) +
+                       np.sum(terms[second], axis=1) -
+                       np.sum(new_first, axis=1) - np.sum(new_second, axis=1))
+        best = np.argmax(improvement)
+        if improvement[best] <= 1e-12 * total:
+            stall += 1
+            if stall >= 10:
+                break
+            continue
+        stall = 0
+        total -= 2 * improvement[best]
+
+        i = first[best]
+        j = second[best]
+        points[[i, j], column] = points[[j, i], column]
+
+        pair = squared[i, j]
+        squared[i] += change[best]
+        squared[j] -= change[best]
+        squared[i, i] = squared[j, j] = 0
+        squared[i, j] = squared[j, i] = pair
+        squared[:, i] = squared[i]
+        squared[:, j] = squared[j]
+
+        terms[i] = new_first[best]
+        terms[j] = new_second[best]
+        terms[:, i] = terms[i]
+        terms[:, j] = terms[j]
+
+    return points, phi_p(points, p)
+
+
+def phi_p(points, p = 50):
+    r"""Calculates the :math:`\phi_p` space-filling criterion of a design.
+
+    Smaller values are more space-filling, see :func:`build_latin_hypercube`.
+
+    :param points: The runs, one per row.
+    :param p: The exponent of the distances.
+    """
+    terms = _terms(_squared_distances(np.asarray(points, dtype=float)), p)
+    return (np.sum(terms) / 2) ** (1 / p)
+
+
+def _squared_distances(points):
+    """Returns the matrix of squared distances between every pair of runs."""
+    squared = np.zeros((len(points), len(points)))
+    for column in points.T:
+        squared += (column[:, np.newaxis] - column) ** 2
+    return squared
+
+
+def _terms(squared, p):
+    """Returns d^-p for squared distances d^2, and 0 for a run with itself."""
+    with np.errstate(divide='ignore'):
+        terms = squared ** (-p / 2)
+    terms[squared == 0] = 0
+    return terms
+
+
+def _integers(rng, low, high, size):
+    """Draws integers from either a Generator or a RandomState."""
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(low, high, size)
+    return rng.randint(low, high, size)
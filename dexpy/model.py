@@ -1,6 +1,8 @@
 """Functions for creating and working with a model."""
 
 from enum import Enum
+import numpy as np
+from patsy.builtins import I
 
 class ModelOrder(Enum):
     """Represents a full model order."""
@@ -32,3 +34,180 @@ def make_model(factor_names, model_order, include_powers = True):
         return "+".join([interaction_model, squared_terms, cubed_terms])
 
     return "+".join(factor_names)
+
+
+class ModelExpander(object):
+    """Expands factor settings into rows of a model matrix.
+
+    The expander is built once from a patsy DesignInfo, each factor's code is
+    compiled up front and every call evaluates the model on whole columns of
+    factor settings. This avoids going through patsy, or eval'ing code, for
+    every point that needs to be expanded.
+
+    Numerical factors are supported, including :code:`I(...)`, :code:`pow`,
+    inverse and interaction terms. Categorical factors and stateful transforms
+    (e.g. :code:`center(X1)`) are not.
+
+    Usage:
+      >>> X = patsy.dmatrix("X1 + X2 + X1:X2 + pow(X1, 2)", design)
+      >>> expand = ModelExpander(X.design_info, ["X1", "X2"])
+      >>> expand(np.array([[0.5, -1.0], [1.0, 1.0]]))
+      array([[ 1.  ,  0.5 , -1.  , -0.5 ,  0.25],
+             [ 1.  ,  1.  ,  1.  ,  1.  ,  1.  ]])
+    """
+
+    def __init__(self, design_info, factor_names):
+        """Compiles the model described by design_info.
+
+        :param design_info: The patsy.DesignInfo describing the model.
+        :param factor_names: The names of the factors, in the same order as the
+                             columns of the factor settings to be expanded.
+        """
+        self.factor_names = list(factor_names)
+        self.column_names = list(design_info.column_names)
+
+        factor_index = {}
+        self._factors = []
+        self._factor_variables = []
+        for factor, info in design_info.factor_infos.items():
+            if (info.type != "numerical" or info.num_columns != 1 or
+                    info.state["transforms"]):
+                raise ValueError("Can't expand the model term "
+                                 "'{}'".format(factor.name()))
+            code = compile(info.state["eval_code"], "<model>", "eval")
+            # resolve everything but the factors themselves now, so that
+            # evaluating the code doesn't need patsy's environment lookups
+            env = info.state["eval_env"].with_outer_namespace({"I": I})
+            namespace = {}
+            for name in code.co_names:
+                if name not in self.factor_names and name in env.namespace:
+                    namespace[name] = env.namespace[name]
+            factor_index[factor] = len(self._factors)
+            self._factors.append((code, namespace))
+            self._factor_variables.append(
+                [self.factor_names.index(name) for name in code.co_names
+                 if name in self.factor_names])
+
+        # each column of the model matrix is a product of factors, the
+        # intercept is the empty product
+        self._columns = []
+        for _, subterms in design_info.term_codings.items():
+            for subterm in subterms:
+                self._columns.append([factor_index[f]
+                                      for f in subterm.factors])
+
+    def __call__(self, factor_settings):
+        """Returns the model matrix rows for an (n x k) array of settings."""
+        factor_settings = np.atleast_2d(np.asarray(factor_settings,
+                                                   dtype=float))
+        run_count = factor_settings.shape[0]
+        env = dict(zip(self.factor_names, factor_settings.T))
+
+        factor_values = [eval(code, namespace, env)
+                         for code, namespace in self._factors]
+
+        X = np.ones((run_count, len(self._columns)))
+        for c, factors in enumerate(self._columns):
+            for f in factors:
+                X[:, c] *= factor_values[f]
+        return X
+
+    def moment_matrix(self, node_count=32):
+        r"""Returns the moment matrix of the model over the [-1, 1] cube.
+
+        This is :math:`\frac{1}{V}\int f(x)f(x)'dx` where f expands a point
+        into a row of the model matrix. Every column must be a product of
+        polynomials in single factors, the integral then separates into one
+        dimensional integrals that are calculated exactly by Gauss-Legendre
+        quadrature. Terms of several factors, e.g. :code:`I(X1*X2)`, are
+        split into their single factor parts. Other terms, such as inverse
+        terms, raise a ValueError.
+
+        :param node_count: The number of quadrature nodes, each column may be
+                           a polynomial of degree less than node_count / 2 in
+                           each factor.
+        """
+        nodes, weights = np.polynomial.legendre.leggauss(node_count)
+        weights /= 2 # uniform density over [-1, 1]
+
+        env = dict.fromkeys(self.factor_names, nodes)
+        factor_values = [eval(code, namespace, env)
+                         for code, namespace in self._factors]
+
+        # G[c, f] is the part of column c that depends on factor f
+        factor_count = len(self.factor_names)
+        G = np.ones((len(self._columns), factor_count, node_count))
+        for c, factors in enumerate(self._columns):
+            for f in factors:
+                variables = self._factor_variables[f]
+                if len(variables) <= 1:
+                    variable = variables[0] if variables else 0
+                    G[c, variable] *= factor_values[f]
+                    continue
+                parts = self._separate_factor(f, nodes)
+                if parts is None:
+                    raise ValueError("Can't integrate the model term '{}' "
+                                     "analytically, it isn't a product of "
+                                     "terms in single factors".format(
+                                         self.column_names[c]))
+                for variable, part in zip(variables, parts):
+                    G[c, variable] *= part
+
+        # the quadrature is only exact if every product of two columns is a
+        # polynomial of degree less than 2 * node_count, check each part is a
+        # low degree polynomial
+        degree = node_count // 2 - 1
+        vander = np.polynomial.legendre.legvander(nodes, degree)
+        for c in range(len(self._columns)):
+            values = G[c].T
+            fit = np.dot(vander, np.linalg.lstsq(vander, values, rcond=None)[0])
+            if (not np.all(np.isfinite(values)) or
+                    not np.allclose(fit, values, rtol=1e-8, atol=1e-8)):
+                raise ValueError("Can't integrate the model term '{}' "
+                                 "analytically, it isn't a polynomial of "
+                                 "degree {} or less".format(
+                                     self.column_names[c], degree))
+
+        W = np.ones((len(self._columns), len(self._columns)))
+        for f in range(factor_count):
+            W *= np.dot(G[:, f] * weights, G[:, f].T)
+        return W
+
+    def _separate_factor(self, f, nodes, max_variables=3):
+        """Splits a factor of several variables into one part per variable.
+
+        The factor is evaluated on the grid of nodes for its variables, and is
+        separable if it is the outer product of its slices through the point
+        where it is largest.
+
+        :returns: A list with the values of each variable's part at the
+                  nodes, or None if the factor isn't separable.
+        """
+        variables = self._factor_variables[f]
+        if len(variables) > max_variables:
+            return None
+        code, namespace = self._factors[f]
+        grids = np.meshgrid(*([nodes] * len(variables)), indexing='ij')
+        env = dict(zip([self.factor_names[v] for v in variables], grids))
+        values = eval(code, namespace, env) * np.ones(grids[0].shape)
+        if not np.all(np.isfinite(values)):
+            return None
+
+        peak = np.unravel_index(np.argmax(np.abs(values)), values.shape)
+        scale = values[peak]
+        if scale == 0:
+            return [np.zeros(len(nodes))] * len(variables)
+        parts = []
+        for i in range(len(variables)):
+            index = list(peak)
+            index[i] = slice(None)
+            parts.append(values[tuple(index)] / scale)
+        parts[0] = parts[0] * scale
+
+        product = parts[0]
+        for part in parts[1:]:
+            product = np.multiply.outer(product, part)
+        if not np.allclose(product, values, rtol=1e-8,
+                           atol=1e-8 * abs(scale)):
+            return None
+        return parts
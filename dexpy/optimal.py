@@ -5,10 +5,44 @@ import dexpy.design
 import pandas as pd
 import numpy as np
 import math
+import copy
+import functools
+import itertools
 import logging
+import multiprocessing
+import time
+import scipy.linalg
+import scipy.optimize
+import numpy.polynomial.polynomial as npp
 from patsy import dmatrix, ModelDesc
-from dexpy.model import make_model, ModelOrder
-from dexpy.samplers import hit_and_run
+from dexpy.model import make_model, ModelOrder, ModelExpander
+from dexpy.samplers import hit_and_run, check_random_state, spawn_seeds
+from dexpy.samplers import chebyshev_center, low_discrepancy_sample
+
+# a continuous coordinate search locates settings to within this distance, and
+# only makes exchanges that improve the criterion by at least this fraction
+CONTINUOUS_XATOL = 1e-4
+CONTINUOUS_TOLERANCE = 1e-6
+
+# a continuous search polishes the design the grid converged to, and stops
+# once a pass improves the criterion by less than this fraction
+POLISH_TOLERANCE = 1e-4
+
+# grid exchanges have to improve the criterion by at least this fraction,
+# smaller changes are within the rounding error of the scores
+EXCHANGE_TOLERANCE = 4 * np.finfo(float).eps
+
+# exchanges that shrink det(X'X) by more than this factor make it numerically
+# singular, and aren't considered by criteria that divide by the ratio
+SINGULAR_RATIO = np.sqrt(np.finfo(float).eps)
+
+# the number of rank-2 updates between exact refactorizations of X'X
+REFACTOR_INTERVAL = 100
+
+# an exchange that improves the criterion by more than this fraction was made
+# from an ill-conditioned design, whose updates are inaccurate, so X'X is
+# refactored straight away
+REFACTOR_IMPROVEMENT = 0.1
 
 def update(XtXi, new_point, old_point):
     """rank-2 update of the variance-covariance matrix
@@ -24,31 +58,458 @@ def update(XtXi, new_point, old_point):
     F2x2FD = np.dot(np.dot(F1, Inverse2x2), FD)
     return XtXi - np.dot(XtXi, F2x2FD)
 
-def expand_point(design_point, code):
-    """Converts a point in factor space to conform with the X matrix."""
-    return np.array(eval(code, {}, design_point))
+def refactor(X, XtXi=None, fixed=None):
+    """Recalculates the variance-covariance matrix from the model matrix.
+
+    :math:`X'X` is inverted with a Cholesky factorization, falling back to a
+    general inverse if it isn't numerically positive definite.
+
+    :param XtXi: The variance matrix as tracked through updates. If given, the
+                 drift between it and the exact matrix is returned too.
+    :param fixed: :math:`X'X` for any runs of the design that aren't in X.
+    :returns: A tuple of the exact variance matrix and the relative drift
+              (in the Frobenius norm) of **XtXi** from it.
+    """
+    XtX = np.dot(X.T, X)
+    if fixed is not None:
+        XtX += fixed
+    try:
+        factor = scipy.linalg.cho_factor(XtX)
+        exact = scipy.linalg.cho_solve(factor, np.identity(len(XtX)))
+    except np.linalg.LinAlgError:
+        exact = np.linalg.inv(XtX)
+
+    drift = 0.0
+    if XtXi is not None:
+        drift = (np.linalg.norm(XtXi - exact) /
+                 max(np.linalg.norm(exact), np.finfo(float).tiny))
+    return exact, drift
+
+def quadratic_forms(A, new_point, old_point):
+    """Returns :math:`x'Ax` for new_point (or each of its rows) and old_point.
+
+    Both forms are summed in the same order, so a new point equal to the old
+    one scores exactly the same and an exchange with itself doesn't look like
+    an improvement due to rounding.
+    """
+    rows = np.vstack((new_point, old_point))
+    forms = np.sum(np.dot(rows, A) * rows, axis=-1)
+    return forms[:-1].reshape(np.shape(new_point)[:-1]), forms[-1]
 
 def delta(X, XtXi, row, new_point):
     """Calculates the change in D-optimality from exchanging a point.
 
     This is equation (1) in Meyer and Nachtsheim :cite:`MeyerNachtsheim1995`.
+
+    new_point may also be a matrix with one candidate point per row, in which
+    case an array of changes is returned.
     """
     old_point = X[row]
 
-    added_variance = np.dot(new_point, np.dot(XtXi, new_point.T))
-    removed_variance = np.dot(old_point, np.dot(XtXi, old_point.T))
-    covariance = np.dot(new_point, np.dot(XtXi, old_point.T))
+    (added_variance, removed_variance) = quadratic_forms(XtXi, new_point,
+                                                         old_point)
+    covariance = np.dot(new_point, np.dot(XtXi, old_point))
     return (
         1 + (added_variance - removed_variance) +
             (covariance * covariance - added_variance * removed_variance)
     )
 
+def i_delta(X, XtXi, XtXiWXtXi, row, new_point):
+    """Calculates the change in I-optimality from exchanging a point.
+
+    I-optimality is the average prediction variance over the design region,
+    :math:`tr(W(X'X)^{-1})` for the region moment matrix W. This returns the
+    reduction in it from the rank-2 update in :func:`update`, which only
+    needs quadratic forms in :math:`(X'X)^{-1}` and
+    :math:`(X'X)^{-1}W(X'X)^{-1}`.
+
+    new_point may also be a matrix with one candidate point per row, in which
+    case an array of changes is returned.
+    """
+    old_point = X[row]
+
+    (added_variance, removed_variance) = quadratic_forms(XtXi, new_point,
+                                                         old_point)
+    covariance = np.dot(new_point, np.dot(XtXi, old_point))
+
+    (added_weighted, removed_weighted) = quadratic_forms(XtXiWXtXi, new_point,
+                                                         old_point)
+    weighted_covariance = np.dot(new_point, np.dot(XtXiWXtXi, old_point))
+
+    change_in_d = (
+        1 + (added_variance - removed_variance) +
+            (covariance * covariance - added_variance * removed_variance)
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = ((1 - removed_variance) * added_weighted +
+                  2 * covariance * weighted_covariance -
+                  (1 + added_variance) * removed_weighted) / change_in_d
+    # rounding can make an exchange that leaves the design singular look like
+    # a huge improvement
+    return np.where(change_in_d > SINGULAR_RATIO, change, -np.inf)
+
+def update_weighted(XtXi, XtXiWXtXi, new_point, old_point):
+    """rank-2 update of :math:`(X'X)^{-1}W(X'X)^{-1}`
+
+    This applies the update from :func:`update` to both sides of the product,
+    so it is O(p^2) instead of recalculating the product.
+    """
+    F2 = np.vstack((new_point, old_point))
+    F1 = F2.T.copy()
+    F1[:,1] *= -1
+    FD = np.dot(F2, XtXi)
+    I2x2 = np.identity(2) + np.dot(FD, F1)
+    Inverse2x2 = np.linalg.inv(I2x2)
+
+    # (X'X)^-1 changes by U * FD, multiply that through both sides
+    U = np.dot(np.dot(XtXi, F1), Inverse2x2)
+    B = np.dot(XtXiWXtXi, F1)
+    return (XtXiWXtXi - np.dot(U, np.dot(F2, XtXiWXtXi)) -
+            np.dot(np.dot(B, Inverse2x2), FD) +
+            np.dot(np.dot(U, np.dot(F2, B)), np.dot(Inverse2x2, FD)))
+
+class Criterion(object):
+    """An optimality criterion for the exchange algorithms.
+
+    The exchange algorithms only talk to a criterion through these hooks, so a
+    new criterion can be added by implementing them rather than changing the
+    algorithms. Criteria are minimized. Each build works on its own copy of
+    the criterion, which may cache whatever it needs to score changes quickly.
+
+    :ivar value: The current value of the criterion, kept up to date by
+                 :meth:`initialize` and :meth:`apply_update`.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.value = None
+
+    def evaluate(self, XtXi):
+        """Returns the value of the criterion for a variance matrix."""
+        raise NotImplementedError
+
+    def initialize(self, XtXi):
+        """Sets up the criterion for a design with variance matrix XtXi."""
+        self.value = self.evaluate(XtXi)
+
+    def score_change(self, XtXi, old_row, new_rows):
+        """Scores exchanging a row of the model matrix for each of new_rows.
+
+        :param XtXi: The current variance matrix :math:`(X'X)^{-1}`.
+        :param old_row: The model matrix row being exchanged.
+        :param new_rows: A matrix with a candidate model matrix row per row.
+        :returns: An array with the relative improvement in the criterion for
+                  each candidate, positive values are improvements.
+        """
+        raise NotImplementedError
+
+    def relative_improvement(self, old_value, new_value):
+        """Returns the fraction by which the criterion improved."""
+        return (old_value - new_value) / abs(old_value)
+
+    def apply_update(self, XtXi, old_row, new_row, change):
+        """Exchanges old_row for new_row.
+
+        :param change: The score of the exchange from :meth:`score_change`.
+        :returns: The updated variance matrix.
+        """
+        self.value *= 1 - change
+        return update(XtXi, new_row, old_row)
+
+    def line_polynomials(self, XtXi, old_row, coefficients):
+        """Scores exchanging a row for any point along a polynomial curve.
+
+        This is optional, it lets a continuous coordinate search find the best
+        exchange exactly rather than searching for it.
+
+        :param coefficients: A matrix where row j holds the coefficients of
+                             :math:`t^j` in the model matrix row along the
+                             curve.
+        :returns: A tuple of the numerator and denominator polynomials
+                  (coefficients in increasing order) of :meth:`score_change`
+                  as a function of t, or None if they aren't available.
+        """
+        return None
+
+
+class DOptimality(Criterion):
+    """D-optimality, the log determinant of :math:`(X'X)^{-1}`.
+
+    Minimizing this gives the most precise estimates of the model
+    coefficients as a whole.
+    """
+
+    name = "D"
+
+    def evaluate(self, XtXi):
+        return np.linalg.slogdet(XtXi)[1]
+
+    def score_change(self, XtXi, old_row, new_rows):
+        # the ratio of the new determinant of X'X to the old, less one
+        return delta(old_row[np.newaxis], XtXi, 0, new_rows) - 1
+
+    def initialize(self, XtXi):
+        Criterion.initialize(self, XtXi)
+        self._model_size = len(XtXi)
+
+    def relative_improvement(self, old_value, new_value):
+        # the improvement in D-efficiency, det(X'X) ** (1 / p)
+        return -math.expm1((new_value - old_value) / self._model_size)
+
+    def apply_update(self, XtXi, old_row, new_row, change):
+        self.value -= math.log(1 + change)
+        return update(XtXi, new_row, old_row)
+
+    def line_polynomials(self, XtXi, old_row, coefficients):
+        removed_variance = np.dot(old_row, np.dot(XtXi, old_row))
+        added_variance = quadratic_form_polynomial(coefficients, XtXi)
+        covariance = np.dot(coefficients, np.dot(XtXi, old_row))
+        numerator = npp.polyadd((1 - removed_variance) * added_variance,
+                                npp.polymul(covariance, covariance))
+        numerator[0] -= removed_variance
+        return numerator, np.ones(1)
+
+
+class LOptimality(Criterion):
+    """L-optimality, the trace of the weighted variance :math:`tr(W(X'X)^{-1})`.
+
+    Changes are scored using :math:`(X'X)^{-1}W(X'X)^{-1}`, which is kept up to
+    date with rank-2 updates along with :math:`(X'X)^{-1}`.
+
+    :param weights: The symmetric p x p weight matrix W.
+    """
+
+    name = "L"
+
+    def __init__(self, weights):
+        Criterion.__init__(self)
+        self.weights = np.asarray(weights, dtype=float)
+        self._weighted = None
+
+    def evaluate(self, XtXi):
+        return np.sum(self.weights * XtXi)
+
+    def initialize(self, XtXi):
+        Criterion.initialize(self, XtXi)
+        self._weighted = np.dot(np.dot(XtXi, self.weights), XtXi)
+
+    def score_change(self, XtXi, old_row, new_rows):
+        return i_delta(old_row[np.newaxis], XtXi, self._weighted, 0,
+                       new_rows) / self.value
+
+    def apply_update(self, XtXi, old_row, new_row, change):
+        self._weighted = update_weighted(XtXi, self._weighted,
+                                         new_row, old_row)
+        return Criterion.apply_update(self, XtXi, old_row, new_row, change)
+
+    def line_polynomials(self, XtXi, old_row, coefficients):
+        removed_variance = np.dot(old_row, np.dot(XtXi, old_row))
+        added_variance = quadratic_form_polynomial(coefficients, XtXi)
+        covariance = np.dot(coefficients, np.dot(XtXi, old_row))
+        removed_weighted = np.dot(old_row, np.dot(self._weighted, old_row))
+        added_weighted = quadratic_form_polynomial(coefficients,
+                                                   self._weighted)
+        weighted_covariance = np.dot(coefficients,
+                                     np.dot(self._weighted, old_row))
+
+        # see i_delta
+        change_in_d = npp.polyadd((1 - removed_variance) * added_variance,
+                                  npp.polymul(covariance, covariance))
+        change_in_d[0] += 1 - removed_variance
+        numerator = npp.polyadd(
+            (1 - removed_variance) * added_weighted,
+            2 * npp.polymul(covariance, weighted_covariance))
+        numerator = npp.polysub(numerator, removed_weighted * added_variance)
+        numerator[0] -= removed_weighted
+        return numerator / self.value, change_in_d
+
+
+class AOptimality(LOptimality):
+    """A-optimality, the trace of :math:`(X'X)^{-1}`.
+
+    This is the average variance of the model coefficients.
+    """
+
+    name = "A"
+
+    def __init__(self, model_size):
+        LOptimality.__init__(self, np.identity(model_size))
+
+
+class IOptimality(LOptimality):
+    """I-optimality, the average prediction variance over the design region.
+
+    :param moments: The region moment matrix, see :func:`moment_matrix`.
+    """
+
+    name = "I"
+
+    def __init__(self, moments):
+        LOptimality.__init__(self, moments)
+
+
+def quadratic_form_polynomial(coefficients, A):
+    """Returns the polynomial :math:`x(t)'Ax(t)`.
+
+    :param coefficients: A matrix where row j holds the coefficients of
+                         :math:`t^j` in x(t).
+    :returns: The coefficients of the result, in increasing order.
+    """
+    Q = np.dot(np.dot(coefficients, A), coefficients.T)
+    term_count = len(coefficients)
+    result = np.zeros(2 * term_count - 1)
+    for j in range(term_count):
+        result[j:j + term_count] += Q[j]
+    return result
+
+def maximize_rational(numerator, denominator, low, high):
+    """Finds the maximum of numerator(t) / denominator(t) on [low, high].
+
+    The maximum is either at one of the ends or at a real root of the
+    derivative's numerator. The denominator must be positive, points where it
+    is nearly zero are never chosen.
+
+    :returns: A tuple of t and the value at the maximum.
+    """
+    slope = npp.polysub(npp.polymul(npp.polyder(numerator), denominator),
+                        npp.polymul(numerator, npp.polyder(denominator)))
+    slope = npp.polytrim(slope, np.finfo(float).eps * np.max(np.abs(slope)))
+
+    t = [low, high]
+    if len(slope) > 1:
+        roots = npp.polyroots(slope)
+        roots = roots.real[np.abs(roots.imag) <= 1e-8 * (1 + np.abs(roots))]
+        t.extend(roots[(roots > low) & (roots < high)])
+    t = np.array(t)
+
+    below = npp.polyval(t, denominator)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = npp.polyval(t, numerator) / below
+    values[~np.isfinite(values) | (below <= SINGULAR_RATIO)] = -np.inf
+    best = np.argmax(values)
+    return (t[best], values[best])
+
+def polynomial_coefficients(expand, design_point, factor, low, high, degree=4):
+    """Returns the model matrix row along one coordinate as a polynomial.
+
+    The model is expanded at degree + 1 settings of the factor between low and
+    high, and the interpolating polynomial is checked against one more
+    setting.
+
+    :returns: A matrix where row j holds the coefficients of :math:`t^j`, or
+              None if the model isn't a polynomial in the factor of at most
+              the given degree (e.g. it has an inverse term).
+    """
+    # Chebyshev nodes keep the interpolation well conditioned
+    nodes = np.cos(np.pi * (np.arange(degree + 1) + 0.5) / (degree + 1))
+    nodes = 0.5 * (low + high) + 0.5 * (high - low) * nodes
+    check = low + (high - low) / 3
+
+    candidates = np.tile(design_point, (degree + 2, 1))
+    candidates[:-1, factor] = nodes
+    candidates[-1, factor] = check
+    with np.errstate(all='ignore'):
+        rows = expand(candidates)
+    if not np.all(np.isfinite(rows)):
+        return None
+
+    coefficients = np.linalg.solve(npp.polyvander(nodes, degree), rows[:-1])
+    check_row = np.dot(check ** np.arange(degree + 1), coefficients)
+    if not np.allclose(check_row, rows[-1], rtol=1e-8, atol=1e-8):
+        return None
+    return coefficients
+
+def moment_matrix(factor_names, model, **kwargs):
+    r"""Calculates the moment matrix of a model over a design region.
+
+    The moment matrix :math:`W = \frac{1}{V}\int f(x)f(x)'dx` is used to
+    calculate the average prediction variance of a design,
+    :math:`tr(W(X'X)^{-1})`. Over the [-1, 1] cube it is calculated
+    analytically. For a constrained region it is estimated from a uniform
+    sample of the region drawn with :func:`hit_and_run
+    <dexpy.samplers.hit_and_run>`. The analytic moments need every term to
+    be a polynomial in single factors, for other models (e.g. with inverse
+    terms) pass the cube's constraints to use the sampled estimate.
+
+    :param factor_names: The names of the factors in the model.
+    :param model: A patsy formula for the model.
+
+    :Keyword Arguments:
+        * **constraint_matrix** (`array`) -- \
+            The constraints on the region, in the form Ax <= b. This should \
+            include the factor bounds.
+        * **bounds** (`array`) -- \
+            The bounds on the region, in the form Ax <= b.
+        * **x0** (`array`) -- \
+            A feasible starting point for the sampler, defaults to the \
+            Chebyshev center of the region.
+        * **sample_count** (`integer`) -- \
+            The number of points to sample, defaults to 10000. A Sobol \
+            sample is rounded up to a power of 2, which keeps it balanced.
+        * **sampler** (`string`) -- \
+            "hit_and_run" (the default), or "sobol" or "halton" to keep the \
+            points of a quasi-random sample of the cube that satisfy the \
+            constraints, see :func:`low_discrepancy_sample \
+            <dexpy.samplers.low_discrepancy_sample>`. The quasi-random \
+            estimates are more accurate for the same number of points, as \
+            long as the region isn't a small part of the cube.
+        * **random_state** -- \
+            The seed or generator for the sample, see \
+            :func:`check_random_state <dexpy.samplers.check_random_state>`.
+    """
+    X = dmatrix(model, pd.DataFrame(np.zeros((1, len(factor_names))),
+                                    columns=factor_names))
+    expand = ModelExpander(X.design_info, factor_names)
+
+    constraint_matrix = kwargs.get('constraint_matrix', None)
+    if constraint_matrix is None:
+        return expand.moment_matrix()
+
+    bounds = kwargs['bounds']
+    sample_count = kwargs.get('sample_count', 10000)
+    sampler = kwargs.get('sampler', 'hit_and_run')
+    random_state = kwargs.get('random_state', None)
+
+    if sampler == 'hit_and_run':
+        x0 = kwargs.get('x0', None)
+        if x0 is None:
+            (x0, _) = chebyshev_center(constraint_matrix, bounds)
+        sample = hit_and_run(x0, constraint_matrix, bounds, sample_count,
+                             random_state=random_state)
+    else:
+        if sampler == 'sobol':
+            sample_count = 1 << (sample_count - 1).bit_length()
+        sample = low_discrepancy_sample(sample_count, len(factor_names),
+                                        sampler, random_state=random_state)
+        feasible = np.all(np.dot(sample, np.transpose(constraint_matrix)) <=
+                          bounds, axis=1)
+        sample = sample[feasible]
+        if len(sample) == 0:
+            raise ValueError("None of the {} points sampled from the cube "
+                             "satisfy the constraints".format(sample_count))
+
+    F = expand(sample)
+    return np.dot(F.T, F) / len(sample)
+
 def build_optimal(factor_count, **kwargs):
     r"""Builds an optimal design.
 
     This uses the Coordinate-Exchange algorithm from Meyer and Nachtsheim 1995
     :cite:`MeyerNachtsheim1995`.
 
+    By default the design is D-optimal, which gives precise estimates of the
+    model coefficients. An I-optimal design minimizes the average prediction
+    variance over the design region instead, which is usually preferred for
+    response surface designs.
+
+    Coordinate exchange can get stuck in a local optimum, so the algorithm can
+    be started several times from different random designs, keeping the design
+    with the best criterion value. The starts are independent, so they may be
+    spread across a pool of processes. Each start draws from its own stream
+    spawned from **random_state**, so the result for a given seed does not
+    depend on the number of processes used.
+
     :param factor_count: The number of factors to build for.
     :type factor_count: integer
 
@@ -62,7 +523,77 @@ def build_optimal(factor_count, **kwargs):
         * **run_count** (`integer`) -- \
             The number of runs to use in the design. This must be equal\
             to or greater than the rank of the model.
+        * **criterion** (`string or` :class:`Criterion`) -- \
+            The optimality criterion, "D" (the default), "A" or "I", or a \
+            :class:`Criterion` instance.
+        * **moments** (`array`) -- \
+            The region moment matrix for I-optimality, see \
+            :func:`moment_matrix`. Defaults to the moments of the [-1, 1] cube.
+        * **coordinate_search** (`string`) -- \
+            How each coordinate is searched. "grid" (the default) picks the \
+            best of **steps** evenly spaced levels from -1 to 1. \
+            "continuous" runs the grid search to convergence, then polishes \
+            the design by moving each coordinate to its best setting \
+            anywhere from -1 to 1, until a pass improves the criterion by \
+            less than 0.01%. The design is never worse than the grid's for \
+            the same seed, at the cost of the polishing passes' \
+            evaluations. The line search is exact when the model is a \
+            polynomial in the factor (and the criterion provides \
+            :meth:`Criterion.line_polynomials`), otherwise the best grid \
+            level is refined with Brent's method.
+        * **steps** (`integer`) -- \
+            The number of grid levels for each coordinate, defaults to 12.
+        * **refactor_interval** (`integer`) -- \
+            :math:`(X'X)^{-1}` is kept up to date with rank-2 updates, which \
+            slowly lose accuracy. It is recalculated exactly from a Cholesky \
+            factorization of :math:`X'X` after this many exchanges, after \
+            an exchange that improves the criterion by more than 10% (which \
+            means the design was ill-conditioned) and at the end of each \
+            pass, defaults to 100. Use 0 to only recalculate it at the end \
+            of each pass.
+        * **n_starts** (`integer`) -- \
+            The number of independent starts to run, defaults to 1.
+        * **n_jobs** (`integer`) -- \
+            The number of processes to run the starts in, defaults to 1. \
+            Use None to use one process per cpu.
+        * **random_state** (`integer, numpy.random.SeedSequence or \
+          numpy.random.Generator`) -- \
+            The seed for the starting designs, each start gets its own \
+            stream spawned from it. If this is not given and only one start \
+            is requested, the global numpy random state is used.
+        * **max_time** (`float`) -- \
+            The time budget for the whole build in seconds. Once it is used \
+            up, starts stop exchanging and return the best design found so \
+            far, and starts that haven't begun are skipped if they run in \
+            this process. At least one start always runs. The budget is \
+            measured on the monotonic clock, so adjustments to the system \
+            clock don't change it.
+        * **max_passes** (`integer`) -- \
+            The most passes over the design each start makes.
+        * **tolerance** (`float`) -- \
+            A start stops once a pass improves its criterion by less than \
+            this fraction, defaults to 0 (run until no exchange improves it).
+        * **callback** (`callable`) -- \
+            Called after each pass of coordinate exchange with a dict of \
+            the 'start' index, the 'pass' number, the criterion 'value' and \
+            the 'swaps', 'evals' and 'elapsed' seconds so far in the start. \
+            When starts run in a pool the callback is called in the worker \
+            processes, so it has to be picklable (e.g. a module level \
+            function).
+        * **return_stats** (`boolean`) -- \
+            If True, return a tuple of the design and a list with a dict \
+            of statistics for each start. The statistics include the \
+            largest relative drift of the updated :math:`(X'X)^{-1}` found \
+            by a refactorization.
+        * **return_report** (`boolean`) -- \
+            If True, return a tuple of the design and an \
+            :class:`OptimalBuildReport` with the convergence of every start.
     """
+    build_time = time.monotonic()
+    max_time = kwargs.get('max_time', None)
+    deadline = None
+    if max_time is not None:
+        deadline = time.monotonic() + max_time
     factor_names = dexpy.design.get_factor_names(factor_count)
 
     model = kwargs.get('model', None)
@@ -71,88 +602,689 @@ def build_optimal(factor_count, **kwargs):
         model = make_model(factor_names, order, True)
 
     run_count = kwargs.get('run_count', 0)
+    n_starts = kwargs.get('n_starts', 1)
+    n_jobs = kwargs.get('n_jobs', 1)
+    random_state = kwargs.get('random_state', None)
+    criterion = make_criterion(kwargs.get('criterion', 'D'), factor_names,
+                               model, kwargs.get('moments', None))
+
+    start_options = { 'criterion': criterion, 'deadline': deadline }
+    for option in ['coordinate_search', 'steps', 'refactor_interval',
+                   'callback', 'max_passes', 'tolerance']:
+        if option in kwargs:
+            start_options[option] = kwargs[option]
+    run_start = functools.partial(optimal_start, **start_options)
+
+    if n_starts == 1 and random_state is None:
+        seeds = [None]
+    else:
+        seeds = spawn_seeds(random_state, n_starts)
+    starts = [(factor_names, model, run_count, seed, start)
+              for start, seed in enumerate(seeds)]
+
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or n_starts == 1:
+        results = []
+        for start in starts:
+            if (results and deadline is not None and
+                    time.monotonic() > deadline):
+                logging.info("time budget used up after {} of {} "
+                             "starts".format(len(results), n_starts))
+                break
+            results.append(run_start(*start))
+    else:
+        pool = multiprocessing.Pool(min(n_jobs, n_starts))
+        try:
+            results = pool.starmap(run_start, starts)
+        finally:
+            pool.close()
+            pool.join()
+
+    stats = [start_stats for _, start_stats in results]
+    best = int(np.argmin([s['value'] for s in stats]))
+    design = results[best][0]
+
+    if n_starts > 1:
+        logging.info("best of {} starts was start {}".format(n_starts, best))
+
+    if kwargs.get('return_report', False):
+        report = OptimalBuildReport(stats, best,
+                                    time.monotonic() - build_time)
+        return design, report
+    if kwargs.get('return_stats', False):
+        return design, stats
+    return design
+
+def augment_optimal(existing_design, n_new, model=None, **kwargs):
+    r"""Adds optimal runs to an existing design.
+
+    The existing runs are held fixed, coordinate exchange only changes the
+    settings of the new runs. :math:`X'X` for the existing runs is calculated
+    once, so the cost of the search depends on the number of new runs rather
+    than the size of the whole design.
+
+    :param existing_design: The runs already made, one column per factor in
+                            coded units.
+    :type existing_design: pandas.DataFrame
+    :param n_new: The number of runs to add.
+    :type n_new: integer
+    :param model: The model the augmented design should support, defaults to
+                  the quadratic model for the factors of the existing design.
+    :type model: `patsy formula <https://patsy.readthedocs.io>`_
+
+    :Keyword Arguments:
+        * **criterion** (`string or` :class:`Criterion`) -- \
+            The optimality criterion, "D" (the default), "A" or "I", or a \
+            :class:`Criterion` instance.
+        * **moments** (`array`) -- \
+            The region moment matrix for I-optimality, see \
+            :func:`moment_matrix`. Defaults to the moments of the [-1, 1] cube.
+        * **coordinate_search** (`string`) -- \
+            "grid" or "continuous", see :func:`build_optimal`.
+        * **steps** (`integer`) -- \
+            The number of grid levels for each coordinate.
+        * **refactor_interval** (`integer`) -- \
+            The number of exchanges between exact recalculations of \
+            :math:`(X'X)^{-1}`.
+        * **max_time**, **max_passes**, **tolerance** -- \
+            Limits on the search, see :func:`build_optimal`.
+        * **callback** (`callable`) -- \
+            Called after each pass, see :func:`build_optimal`.
+        * **random_state** -- \
+            The seed or generator for the starting settings of the new runs, \
+            see :func:`check_random_state \
+            <dexpy.samplers.check_random_state>`.
+        * **return_stats** (`boolean`) -- \
+            If True, return a tuple of the design and a dict of statistics.
+
+    :returns: The existing runs followed by the new runs.
+    """
+    max_time = kwargs.get('max_time', None)
+    deadline = None
+    if max_time is not None:
+        deadline = time.monotonic() + max_time
+    factor_names = list(existing_design.columns)
+    if model is None:
+        model = make_model(factor_names, ModelOrder.quadratic, True)
+    if n_new < 1:
+        raise ValueError("Must add at least one run, not {}".format(n_new))
+
+    fixed = dmatrix(model, existing_design)
+    expand = ModelExpander(fixed.design_info, factor_names)
+    fixed = np.asarray(fixed, dtype=float)
+    fixed_information = np.dot(fixed.T, fixed)
+    model_size = fixed.shape[1]
+
+    total_runs = len(fixed) + n_new
+    if model_size > total_runs:
+        raise ValueError("Can't augment to a design of size {} "
+                         "for a model of rank {}. "
+                         "Model: '{}'".format(total_runs, model_size, model))
+
+    # random starting settings for the new runs
+    rng = check_random_state(kwargs.get('random_state', None))
+    points = rng.uniform(-1, 1, (n_new, len(factor_names)))
+    X = np.ascontiguousarray(expand(points))
+    if np.linalg.matrix_rank(fixed_information + np.dot(X.T, X)) < model_size:
+        raise ValueError("Adding {} runs to the existing design can't "
+                         "support the model '{}'".format(n_new, model))
+
+    criterion = make_criterion(kwargs.get('criterion', 'D'), factor_names,
+                               model, kwargs.get('moments', None))
+    criterion = copy.deepcopy(criterion)
+
+    options = { 'fixed_information': fixed_information,
+                'deadline': deadline }
+    for option in ['coordinate_search', 'steps', 'refactor_interval',
+                   'callback', 'max_passes', 'tolerance']:
+        if option in kwargs:
+            options[option] = kwargs[option]
+    stats = coordinate_exchange(criterion, expand, points, X, **options)
+
+    new_runs = pd.DataFrame(points, columns=factor_names)
+    design = pd.concat([existing_design[factor_names], new_runs],
+                       ignore_index=True)
+
+    if kwargs.get('return_stats', False):
+        return design, stats
+    return design
+
+class OptimalBuildReport(object):
+    """The statistics from every start of an optimal design build.
+
+    :ivar starts: A list with a dict of statistics for each start, as returned
+                  with **return_stats** by :func:`build_optimal`. The
+                  statistics for each pass of the start are under 'passes'.
+    :ivar best: The index of the start that gave the design.
+    :ivar elapsed: The wall clock time of the whole build, in seconds.
+    """
+
+    def __init__(self, starts, best, elapsed):
+        self.starts = starts
+        self.best = best
+        self.elapsed = elapsed
+
+    @property
+    def value(self):
+        """The criterion value of the design."""
+        return self.starts[self.best]['value']
+
+    def trajectory(self):
+        """Returns the statistics for every pass of every start.
+
+        :returns: A pandas.DataFrame with a row per pass and columns start,
+                  pass, value, swaps, evals and elapsed.
+        """
+        columns = ['start', 'pass', 'value', 'swaps', 'evals', 'elapsed']
+        rows = [p for start in self.starts for p in start['passes']]
+        return pd.DataFrame(rows, columns=columns)
+
+    def __repr__(self):
+        return ("OptimalBuildReport({} starts, best start {} with {} = {:.6g}, "
+                "{:.3g}s)".format(len(self.starts), self.best,
+                                  self.starts[self.best]['criterion'],
+                                  self.value, self.elapsed))
+
+def make_criterion(criterion, factor_names, model, moments=None):
+    """Returns a :class:`Criterion` instance for a criterion name.
+
+    Criterion instances are returned unchanged.
+    """
+    if isinstance(criterion, Criterion):
+        return criterion
+    if criterion == 'D':
+        return DOptimality()
+    if criterion == 'A':
+        model_size = dmatrix(model, pd.DataFrame(
+            np.zeros((1, len(factor_names))), columns=factor_names)).shape[1]
+        return AOptimality(model_size)
+    if criterion == 'I':
+        # the region moments are the same for every start, only calculate once
+        if moments is None:
+            moments = moment_matrix(factor_names, model)
+        return IOptimality(moments)
+    raise ValueError("Didn't recognize criterion '{}'!".format(criterion))
+
+def optimal_start(factor_names, model, run_count, seed=None, start=0,
+                  **kwargs):
+    """Runs coordinate exchange once from a random starting design.
+
+    :param seed: A numpy.random.SeedSequence used to seed the starting design.
+                 If None, the global numpy random state is used. The start
+                 only draws from its own generator, so starts may run in
+                 parallel.
+    :param start: The index of this start in a multi-start build.
+
+    :Keyword Arguments:
+        * **criterion** (:class:`Criterion`) -- \
+            The criterion to minimize, defaults to D-optimality. The start \
+            works on a copy of it.
+        * The options of :func:`coordinate_exchange`.
+
+    :returns: A tuple of the design and a dict of statistics for the start.
+    """
+    criterion = copy.deepcopy(kwargs.pop('criterion', None) or DOptimality())
+
+    rng = check_random_state(seed)
 
     # first generate a valid starting design
-    (design, X) = bootstrap(factor_names, model, run_count)
-
-    functions = []
-    for _, subterms in X.design_info.term_codings.items():
-        sub_funcs = []
-        for subterm in subterms:
-            for factor in subterm.factors:
-                eval_code = X.design_info.factor_infos[factor].state['eval_code']
-                if eval_code[0] == 'I':
-                    eval_code = eval_code[1:]
-                sub_funcs.append(eval_code)
-        if not sub_funcs:
-            functions.append("1") # intercept
-        else:
-            functions.append("*".join(sub_funcs))
-
-    full_func = "[" + ",".join(functions) + "]"
-    code = compile(full_func, "<string>", "eval")
-
-    steps = 12
+    (design, X) = bootstrap(factor_names, model, run_count, rng)
+
+    expand = ModelExpander(X.design_info, factor_names)
+
+    # the exchange works on contiguous arrays, the DataFrame is only built
+    # once it is finished
+    points = np.array(design.values, dtype=float, order='C')
+    X = np.array(X, dtype=float, order='C')
+
+    stats = coordinate_exchange(criterion, expand, points, X, start=start,
+                                **kwargs)
+
+    design = pd.DataFrame(points, columns=factor_names)
+    return design, stats
+
+def coordinate_exchange(criterion, expand, points, X, **kwargs):
+    """Improves a design in place by exchanging coordinates.
+
+    :param criterion: The :class:`Criterion` to minimize.
+    :param expand: The :class:`ModelExpander <dexpy.model.ModelExpander>` for
+                   the model.
+    :param points: The factor settings, one run per row. Updated in place.
+    :param X: The model matrix for **points**. Updated in place.
+
+    :Keyword Arguments:
+        * **fixed_information** (`array`) -- \
+            :math:`X'X` for runs that are part of the design but can't be \
+            changed, e.g. the runs of an experiment being augmented.
+        * **coordinate_search** (`string`) -- "grid" or "continuous".
+        * **steps** (`integer`) -- The number of grid levels.
+        * **refactor_interval** (`integer`) -- The number of exchanges \
+            between exact recalculations of the variance matrix.
+        * **callback** (`callable`) -- \
+            Called with the statistics for each pass as it finishes, see \
+            :func:`build_optimal`.
+        * **start** (`integer`) -- The index of the start, for the callback.
+        * **max_passes** (`integer`) -- Stop after this many passes.
+        * **tolerance** (`float`) -- \
+            Stop once a pass improves the criterion by less than this \
+            fraction, see :meth:`Criterion.relative_improvement`.
+        * **deadline** (`float`) -- \
+            Stop once :func:`time.monotonic` passes this. The exchange stops \
+            between runs, so the design is always a complete improvement \
+            on the starting design.
+
+    :returns: A dict of statistics for the exchange, with a list of the \
+              statistics for each pass under 'passes' and the reason the \
+              exchange stopped under 'stopped', one of "converged", \
+              "max_passes", "tolerance" or "max_time".
+    """
+    coordinate_search = kwargs.get('coordinate_search', 'grid')
+    if coordinate_search not in ('grid', 'continuous'):
+        raise ValueError("Didn't recognize coordinate search "
+                         "'{}'!".format(coordinate_search))
+    steps = kwargs.get('steps', 12)
+    refactor_interval = kwargs.get('refactor_interval', REFACTOR_INTERVAL)
+    fixed_information = kwargs.get('fixed_information', None)
+    callback = kwargs.get('callback', None)
+    start = kwargs.get('start', 0)
+    max_passes = kwargs.get('max_passes', None)
+    tolerance = kwargs.get('tolerance', 0)
+    deadline = kwargs.get('deadline', None)
+    start_time = time.monotonic()
+
+    factor_count = points.shape[1]
+
     low = -1
     high = 1
+    levels = low + ((high - low) / (steps - 1)) * np.arange(steps)
 
-    XtXi = np.linalg.inv(np.dot(np.transpose(X), X))
-    (_, d_optimality) = np.linalg.slogdet(XtXi)
+    (XtXi, _) = refactor(X, fixed=fixed_information)
+    criterion.initialize(XtXi)
 
     design_improved = True
     swaps = 0
     evals = 0
-    min_change = 1.0 + np.finfo(float).eps
+    refactorizations = 0
+    max_drift = 0.0
+    passes = []
+    # a continuous search starts from the design the grid converges to, as
+    # searching continuously from a random start settles in worse optima
+    search = 'grid'
+    min_change = EXCHANGE_TOLERANCE
+    stopped = "converged"
     while design_improved:
 
         design_improved = False
-        for i in range(0, len(design)):
+        pass_value = criterion.value
+        for i in range(0, len(points)):
 
-            design_point = design.iloc[i]
+            if deadline is not None and time.monotonic() > deadline:
+                stopped = "max_time"
+                break
 
             for f in range(0, factor_count):
 
-                original_value = design_point[f]
-                original_expanded = X[i]
-                best_step = -1
-                best_point = []
-                best_change = min_change
+                line = None
+                if search == 'continuous':
+                    coefficients = polynomial_coefficients(expand, points[i],
+                                                           f, low, high)
+                    if coefficients is not None:
+                        line = criterion.line_polynomials(XtXi, X[i],
+                                                          coefficients)
+                        evals += len(coefficients) + 1
+
+                if line is not None:
+                    (best_level, best_change) = maximize_rational(
+                        line[0], line[1], low, high)
+                    best_point = None
+                else:
+                    # expand every level of this coordinate at once and score
+                    # all of the candidates with a single quadratic form
+                    candidates = np.tile(points[i], (steps, 1))
+                    candidates[:, f] = levels
+                    new_points = expand(candidates)
+                    change = criterion.score_change(XtXi, X[i], new_points)
+                    # e.g. an inverse term at 0
+                    change[~np.isfinite(change)] = -np.inf
+                    # exchanging the current level for itself changes nothing
+                    change[levels == points[i, f]] = -np.inf
+                    evals += steps
+
+                    best_step = np.argmax(change)
+                    best_change = change[best_step]
+                    best_level = levels[best_step]
+                    best_point = new_points[best_step]
 
-                for s in range(0, steps):
+                    if search == 'continuous':
+                        # the best setting is somewhere between the neighbors
+                        # of the best grid level
+                        (level, refined_change, refine_evals) = \
+                            refine_coordinate(
+                                criterion, expand, XtXi, X[i], points[i], f,
+                                levels[max(best_step - 1, 0)],
+                                levels[min(best_step + 1, steps - 1)])
+                        evals += refine_evals
+                        if refined_change > best_change:
+                            best_level = level
+                            best_change = refined_change
+                            best_point = None
 
-                    design_point[f] = low + ((high - low) / (steps - 1)) * s
-                    new_point = expand_point(design_point, code)
-                    change_in_d = delta(X, XtXi, i, new_point)
-                    evals += 1
+                if (search == 'continuous' and
+                        abs(best_level - points[i, f]) < CONTINUOUS_XATOL):
+                    # this is the current setting, to within the search's
+                    # resolution
+                    continue
 
-                    if change_in_d - best_change > np.finfo(float).eps:
-                        best_point = new_point
-                        best_step = s
-                        best_change = change_in_d
+                if best_change > min_change:
 
-                if best_step >= 0:
+                    if best_point is None:
+                        candidate = np.array(points[i])
+                        candidate[f] = best_level
+                        best_point = expand(candidate)[0]
 
                     # update X with the best point
-                    design_point[f] = low + ((high - low) / (steps - 1)) * best_step
-                    XtXi = update(XtXi, best_point, X[i])
+                    points[i, f] = best_level
+                    old_value = criterion.value
+                    XtXi = criterion.apply_update(XtXi, X[i], best_point,
+                                                  best_change)
                     X[i] = best_point
 
-                    d_optimality -= math.log(best_change)
                     design_improved = True
                     swaps += 1
 
-                else:
+                    if refactor_interval and (
+                            swaps % refactor_interval == 0 or
+                            criterion.relative_improvement(
+                                old_value, criterion.value) >
+                            REFACTOR_IMPROVEMENT):
+                        # start again from the exact matrix so the updates
+                        # can't drift far, the criterion resets any caches
+                        # built from the drifted one
+                        (XtXi, drift) = refactor(X, XtXi,
+                                                 fixed_information)
+                        criterion.initialize(XtXi)
+                        refactorizations += 1
+                        max_drift = max(max_drift, drift)
+
+        if design_improved:
+            # the pass statistics and the tolerance use the exact value, the
+            # tracked one drifts on ill-conditioned starting designs
+            (XtXi, drift) = refactor(X, XtXi, fixed_information)
+            criterion.initialize(XtXi)
+            refactorizations += 1
+            max_drift = max(max_drift, drift)
+
+        pass_stats = {
+            'start': start,
+            'pass': len(passes) + 1,
+            'value': criterion.value,
+            'swaps': swaps,
+            'evals': evals,
+            'elapsed': time.monotonic() - start_time,
+        }
+        passes.append(pass_stats)
+        if callback is not None:
+            callback(pass_stats)
 
-                    # restore the original design point value
-                    design_point[f] = original_value
-                    X[i] = original_expanded
+        if stopped == "max_time":
+            break
+        if not design_improved and search == coordinate_search:
+            break
+        if max_passes is not None and len(passes) >= max_passes:
+            stopped = "max_passes"
+            break
+        if not design_improved:
+            # the grid has converged, polish its design with the line search,
+            # which always finds some tiny improvement, so ignore the ones
+            # that are too small to matter
+            search = coordinate_search
+            min_change = CONTINUOUS_TOLERANCE
+            design_improved = True
+        elif (search == 'continuous' and criterion.relative_improvement(
+                pass_value, criterion.value) < POLISH_TOLERANCE):
+            break
+        elif (tolerance and criterion.relative_improvement(
+                pass_value, criterion.value) < tolerance):
+            stopped = "tolerance"
+            break
+
+    logging.info("{} swaps evaluated, {} executed ({:.2f}%)".format(evals, swaps, 100*(swaps / max(evals, 1))))
+
+    # rank starts on the exact criterion, the running value is only tracked
+    # through the updates and may have drifted from it
+    (XtXi, drift) = refactor(X, XtXi, fixed_information)
+    max_drift = max(max_drift, drift)
+    (_, d_optimality) = np.linalg.slogdet(XtXi)
+
+    stats = {
+        'criterion': criterion.name,
+        'value': criterion.evaluate(XtXi),
+        'd_optimality': d_optimality,
+        'swaps': swaps,
+        'evals': evals,
+        'refactorizations': refactorizations,
+        'drift': max_drift,
+        'elapsed': time.monotonic() - start_time,
+        'passes': passes,
+        'stopped': stopped,
+    }
+    return stats
+
+def build_candidate_optimal(factor_count, **kwargs):
+    r"""Builds an optimal design by exchanging points with a candidate set.
+
+    This uses the modified Fedorov algorithm from Cook and Nachtsheim 1980
+    :cite:`CookNachtsheim1980`. Each run in the design is swapped for the
+    candidate point that gives the largest improvement in the criterion. For
+    D-optimality the variance function :math:`d(x) = x'(X'X)^{-1}x` is kept
+    for every candidate and maintained with the same rank-2 updates used for
+    :math:`(X'X)^{-1}`, so finding the best exchange for a run is a single
+    vectorized pass over the candidate set. Other criteria score the whole
+    candidate set with :meth:`Criterion.score_change`.
+
+    This is useful for constrained or categorical regions, where the
+    candidates can be restricted to the points that can actually be run.
+
+    :param factor_count: The number of factors to build for.
+    :type factor_count: integer
+
+    :Keyword Arguments:
+        * **order** (:class:`ModelOrder <dexpy.model.ModelOrder>`) -- \
+            Builds a design for this order model. \
+            Mutually exclusive with the **model** parameter.
+        * **model** (`patsy formula <https://patsy.readthedocs.io>`_) -- \
+            Builds a design for this model formula. \
+            Mutually exclusive with the **order** parameter.
+        * **run_count** (`integer`) -- \
+            The number of runs to use in the design. This must be equal\
+            to or greater than the rank of the model.
+        * **candidates** (`pandas.DataFrame or array`) -- \
+            The candidate points, one per row in coded units. Defaults to \
+            the full three level factorial (-1, 0, 1).
+        * **criterion** (`string or` :class:`Criterion`) -- \
+            The optimality criterion, "D", "A", "I" or a :class:`Criterion` \
+            instance. Defaults to "D".
+        * **moments** (`array`) -- \
+            The region moment matrix for I-optimality, see \
+            :func:`moment_matrix`. Calculated for the cube if not given.
+        * **random_state** -- \
+            The seed or generator used to break ties in the starting \
+            design, see :func:`check_random_state \
+            <dexpy.samplers.check_random_state>`.
+    """
+    factor_names = dexpy.design.get_factor_names(factor_count)
+
+    model = kwargs.get('model', None)
+    if model is None:
+        order = kwargs.get('order', ModelOrder.quadratic)
+        model = make_model(factor_names, order, True)
+
+    candidates = kwargs.get('candidates', None)
+    if candidates is None:
+        candidates = list(itertools.product([-1, 0, 1], repeat=factor_count))
+    candidates = np.array(candidates, dtype=float, order='C')
+    if candidates.ndim != 2 or candidates.shape[1] != factor_count:
+        raise ValueError("Candidates must have one column per factor, "
+                         "expected {} columns".format(factor_count))
+
+    X = dmatrix(model, pd.DataFrame(candidates[:1], columns=factor_names))
+    expand = ModelExpander(X.design_info, factor_names)
+    C = expand(candidates)
+    model_size = C.shape[1]
+
+    run_count = kwargs.get('run_count', 0)
+    if run_count == 0:
+        run_count = model_size
+    if model_size > run_count:
+        raise ValueError("Can't build a design of size {} "
+                         "for a model of rank {}. "
+                         "Model: '{}'".format(run_count, model_size, model))
+
+    design_rows = candidate_start(C, run_count,
+                                  kwargs.get('random_state', None))
+    X = C[design_rows]
+    XtX = np.dot(X.T, X)
+    if np.linalg.matrix_rank(XtX) < model_size:
+        raise ValueError("The candidate set doesn't support the model "
+                         "'{}'".format(model))
+    XtXi = np.linalg.inv(XtX)
+
+    criterion = make_criterion(kwargs.get('criterion', 'D'), factor_names,
+                               model, kwargs.get('moments', None))
+    criterion = copy.deepcopy(criterion)
+    criterion.initialize(XtXi)
+
+    # D-optimality can be scored from the candidate variances
+    use_variance = isinstance(criterion, DOptimality)
+    if use_variance:
+        variance = np.sum(np.dot(C, XtXi) * C, axis=1)
+
+    design_improved = True
+    swaps = 0
+    evals = 0
+    while design_improved:
+
+        design_improved = False
+        for i in range(0, run_count):
+
+            old_row = design_rows[i]
+            old_point = C[old_row]
+            if use_variance:
+                covariance = np.dot(C, np.dot(XtXi, old_point))
+                removed_variance = variance[old_row]
+
+                # equation (1) of Meyer and Nachtsheim for every candidate at
+                # once, less one to match Criterion.score_change
+                change = ((variance - removed_variance) +
+                          (covariance * covariance -
+                           variance * removed_variance))
+            else:
+                change = criterion.score_change(XtXi, old_point, C)
+                change[~np.isfinite(change)] = -np.inf
+            evals += len(C)
+
+            best_row = np.argmax(change)
+            best_change = change[best_row]
+
+            # rounding can make keeping the current point look like a tiny
+            # improvement
+            if (best_row != old_row and
+                    best_change > 2 * np.finfo(float).eps):
+
+                new_point = C[best_row]
+                if use_variance:
+                    variance = update_variance(variance, C, XtXi,
+                                               new_point, old_point)
+                XtXi = criterion.apply_update(XtXi, old_point, new_point,
+                                              best_change)
+                design_rows[i] = best_row
+
+                design_improved = True
+                swaps += 1
+
+        # resync with the exact variance matrix once per pass
+        (XtXi, _) = refactor(C[design_rows])
+        criterion.initialize(XtXi)
+        if use_variance:
+            variance = np.sum(np.dot(C, XtXi) * C, axis=1)
 
     logging.info("{} swaps evaluated, {} executed ({:.2f}%)".format(evals, swaps, 100*(swaps / evals)))
 
-    return design
+    return pd.DataFrame(candidates[design_rows], columns=factor_names)
+
+def update_variance(variance, C, XtXi, new_point, old_point):
+    """rank-2 update of the prediction variance of each candidate point
+
+    This gives :math:`x'(X'X)^{-1}x` for every row of C after exchanging
+    old_point for new_point, using the same update as :func:`update`.
+    """
+    F2 = np.vstack((new_point, old_point))
+    F1 = F2.T.copy()
+    F1[:,1] *= -1
+    I2x2 = np.identity(2) + np.dot(np.dot(F2, XtXi), F1)
+    Inverse2x2 = np.linalg.inv(I2x2)
+    G = np.dot(C, np.dot(XtXi, F2.T))
+    return variance - np.sum(np.dot(G * [1, -1], Inverse2x2) * G, axis=1)
+
+def candidate_start(C, run_count, random_state=None):
+    """Picks a non-singular starting design from the expanded candidates.
 
-def bootstrap(factor_names, model, run_count):
-    """Create a minimal starting design that is non-singular."""
+    Starting from a random candidate, each run is the candidate with the
+    largest prediction variance given the runs chosen so far.
+
+    :param random_state: The seed or generator used to break ties.
+
+    :returns: An array with the row of C for each run.
+    """
+    candidate_count, model_size = C.shape
+    # a small ridge keeps the inverse defined until there are enough runs
+    XtXi = np.identity(model_size) / np.sqrt(np.finfo(float).eps)
+    variance = np.sum(np.dot(C, XtXi) * C, axis=1)
+    # break ties between equal variances randomly
+    order = check_random_state(random_state).permutation(candidate_count)
+
+    design_rows = np.zeros(run_count, dtype=int)
+    for r in range(run_count):
+        best_row = order[np.argmax(variance[order])]
+        design_rows[r] = best_row
+
+        # rank-1 update for the added point
+        x = np.dot(XtXi, C[best_row])
+        XtXi -= np.outer(x, x) / (1 + np.dot(C[best_row], x))
+        variance -= np.dot(C, x) ** 2 / (1 + np.dot(C[best_row], x))
+
+    return design_rows
+
+def refine_coordinate(criterion, expand, XtXi, old_row, design_point,
+                      factor, low, high):
+    """Finds the best setting for one factor of a design point.
+
+    This uses Brent's method to maximize the improvement in the criterion
+    from changing the factor to a setting between low and high.
+
+    :returns: A tuple of the best setting, its improvement and the number of
+              criterion evaluations used.
+    """
+    candidate = np.array(design_point, dtype=float)
+
+    def objective(level):
+        candidate[factor] = level
+        change = criterion.score_change(XtXi, old_row, expand(candidate))[0]
+        if not np.isfinite(change):
+            return np.inf
+        return -change
+
+    result = scipy.optimize.minimize_scalar(objective, bounds=(low, high),
+                                            method='bounded',
+                                            options={'xatol': CONTINUOUS_XATOL})
+    return (result.x, -result.fun, result.nfev)
+
+def bootstrap(factor_names, model, run_count, random_state=None):
+    """Create a minimal starting design that is non-singular.
+
+    :param random_state: The seed or generator to sample the design from.
+    """
     md = ModelDesc.from_formula(model)
     model_size = len(md.rhs_termlist)
     if run_count == 0:
@@ -163,7 +1295,6 @@ def bootstrap(factor_names, model, run_count):
                          "Model: '{}'".format(run_count, model_size, model))
 
     factor_count = len(factor_names)
-    x0 = np.zeros(factor_count)
     # add high/low bounds to constraint matrix
     constraint_matrix = np.zeros((factor_count * 2, factor_count))
     bounds = np.zeros(factor_count * 2)
@@ -176,7 +1307,9 @@ def bootstrap(factor_names, model, run_count):
         bounds[c] = 1
         c += 1
 
-    start_points = hit_and_run(x0, constraint_matrix, bounds, run_count)
+    (x0, _) = chebyshev_center(constraint_matrix, bounds)
+    start_points = hit_and_run(x0, constraint_matrix, bounds, run_count,
+                               random_state=random_state)
 
     d = pd.DataFrame(start_points, columns=factor_names)
     X = dmatrix(model, d)
@@ -1,53 +1,772 @@
 """Contains several samplers."""
 
 import numpy as np
+import scipy.optimize
+import scipy.stats.qmc
 
-def uniform_simplex_sample(N, q):
+# the number of steps between exact recalculations of the constraint slack
+SLACK_RESYNC_INTERVAL = 100
+
+# the largest split R-hat at which a target effective sample size can stop
+# the sampler
+RHAT_THRESHOLD = 1.01
+
+# the default number of points in each chunk from the streaming samplers
+CHUNK_SIZE = 65536
+
+def check_random_state(random_state=None):
+    """Returns a random number generator for a seed.
+
+    :param random_state: None to use the global numpy random state, an
+                         integer or numpy.random.SeedSequence to seed a new
+                         numpy.random.Generator, or a Generator or
+                         RandomState, which is returned as is.
+    """
+    if random_state is None:
+        return np.random.mtrand._rand
+    if isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
+
+def spawn_seeds(random_state, count):
+    """Returns independent seeds for parallel streams.
+
+    :param random_state: An integer or numpy.random.SeedSequence to spawn the
+                         streams from, or None for fresh entropy. A Generator
+                         or RandomState seeds the streams from its next draw.
+    :param count: The number of streams.
+    :returns: A list of numpy.random.SeedSequence.
+    """
+    if isinstance(random_state, np.random.Generator):
+        random_state = int(random_state.integers(2**63))
+    elif isinstance(random_state, np.random.RandomState):
+        random_state = int(random_state.randint(2**63, dtype=np.int64))
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    return random_state.spawn(count)
+
+def uniform_simplex_sample(N, q, random_state=None):
     """Returns an array of points sampled uniformly from a simplex
 
     :param N: the number of random sample to be generated
     :param q: the dimension of the simplex
+    :param random_state: the seed or generator to draw from, see
+                         :func:`check_random_state`
+    """
+    sample = np.zeros((N, q))
+    for _ in iter_uniform_simplex_sample(N, q, N or 1, random_state, sample):
+        pass
+
+    return(sample)
+
+
+def iter_uniform_simplex_sample(N, q, chunk_size = CHUNK_SIZE,
+                                random_state = None, out = None):
+    """Samples a simplex uniformly, a chunk at a time.
+
+    This draws the same points as :func:`uniform_simplex_sample`, without
+    holding more than one chunk in memory.
+
+    :param N: the number of random sample to be generated
+    :param q: the dimension of the simplex
+    :param chunk_size: the most points in each chunk
+    :param random_state: the seed or generator to draw from, see
+                         :func:`check_random_state`
+    :param out: an optional (N, q) array, e.g. a numpy.memmap, to fill with
+                the sample. The chunks are then views of it.
+    :returns: An iterator over arrays of up to chunk_size points.
+    """
+    rng = check_random_state(random_state)
+    out = _check_out(out, (N, q))
+
+    for start in range(0, N, chunk_size):
+        count = min(chunk_size, N - start)
+        sample = rng.exponential(1.0, (count, q))
+        sample /= sample.sum(axis=1)[:, np.newaxis]
+        if out is not None:
+            out[start:start + count] = sample
+            sample = out[start:start + count]
+        yield sample
+
+
+def low_discrepancy_sample(N, p, method = "sobol", scramble = True,
+                           random_state = None):
+    """Returns a quasi-random sample of the coded cube [-1, 1]^p.
+
+    Sobol and Halton sequences cover the cube much more evenly than a
+    pseudo-random sample, so averages over the region (e.g. of the prediction
+    variance) converge faster. Sobol samples are most even when N is a power
+    of 2.
+
+    :param N: the number of points
+    :param p: the number of factors
+    :param method: "sobol" or "halton"
+    :param scramble: randomize the sequence, which keeps it even but makes
+                     repeated samples independent
+    :param random_state: the seed or generator for the scrambling, see
+                         :func:`check_random_state`
+    """
+    sample = np.zeros((N, p))
+    for _ in iter_low_discrepancy_sample(N, p, N or 1, method, scramble,
+                                         random_state, sample):
+        pass
+
+    return(sample)
+
+
+def iter_low_discrepancy_sample(N, p, chunk_size = CHUNK_SIZE,
+                                method = "sobol", scramble = True,
+                                random_state = None, out = None):
+    """Returns a quasi-random sample of the coded cube a chunk at a time.
+
+    The chunks continue the same sequence, so together they are the same
+    points as :func:`low_discrepancy_sample`.
+
+    :param chunk_size: the most points in each chunk
+    :param out: an optional (N, p) array, e.g. a numpy.memmap, to fill with
+                the sample. The chunks are then views of it.
+    :returns: An iterator over arrays of up to chunk_size points.
+
+    The other parameters are the same as for :func:`low_discrepancy_sample`.
+    """
+    engine = _qmc_engine(p, method, scramble, random_state)
+    out = _check_out(out, (N, p))
+
+    for start in range(0, N, chunk_size):
+        count = min(chunk_size, N - start)
+        sample = 2 * engine.random(count) - 1
+        if out is not None:
+            out[start:start + count] = sample
+            sample = out[start:start + count]
+        yield sample
+
+
+def low_discrepancy_simplex_sample(N, q, method = "sobol", scramble = True,
+                                   random_state = None):
+    """Returns a quasi-random sample of a simplex.
+
+    Each point of a q - 1 dimensional quasi-random sample of the unit cube is
+    sorted, and the gaps between 0, the sorted coordinates and 1 are the
+    mixture components. This maps a uniform sample of the cube to a uniform
+    sample of the simplex.
+
+    :param N: the number of points
+    :param q: the number of mixture components
+    :param method: "sobol" or "halton"
+    :param scramble: randomize the sequence
+    :param random_state: the seed or generator for the scrambling, see
+                         :func:`check_random_state`
     """
-    sample = np.random.exponential(1.0, (N, q))
-    row_sums = sample.sum(axis=1)
-    sample = sample / row_sums[:, np.newaxis]
+    sample = np.zeros((N, q))
+    for _ in iter_low_discrepancy_simplex_sample(N, q, N or 1, method,
+                                                 scramble, random_state,
+                                                 sample):
+        pass
 
     return(sample)
 
 
-def hit_and_run(x0, constraint_matrix, bounds, n_samples, thin = 1):
+def iter_low_discrepancy_simplex_sample(N, q, chunk_size = CHUNK_SIZE,
+                                        method = "sobol", scramble = True,
+                                        random_state = None, out = None):
+    """Returns a quasi-random sample of a simplex a chunk at a time.
+
+    :param chunk_size: the most points in each chunk
+    :param out: an optional (N, q) array, e.g. a numpy.memmap, to fill with
+                the sample. The chunks are then views of it.
+    :returns: An iterator over arrays of up to chunk_size points.
+
+    The other parameters are the same as for
+    :func:`low_discrepancy_simplex_sample`.
+    """
+    out = _check_out(out, (N, q))
+    if q == 1:
+        engine = None
+    else:
+        engine = _qmc_engine(q - 1, method, scramble, random_state)
+
+    for start in range(0, N, chunk_size):
+        count = min(chunk_size, N - start)
+        if engine is None:
+            sample = np.ones((count, 1))
+        else:
+            cuts = np.sort(engine.random(count), axis=1)
+            edges = np.hstack((np.zeros((count, 1)), cuts,
+                               np.ones((count, 1))))
+            sample = np.diff(edges, axis=1)
+        if out is not None:
+            out[start:start + count] = sample
+            sample = out[start:start + count]
+        yield sample
+
+
+def _qmc_engine(p, method, scramble, random_state):
+    """Creates a scipy quasi-Monte Carlo engine."""
+    rng = check_random_state(random_state)
+    if method == "sobol":
+        return scipy.stats.qmc.Sobol(p, scramble=scramble, seed=rng)
+    if method == "halton":
+        return scipy.stats.qmc.Halton(p, scramble=scramble, seed=rng)
+    raise ValueError("Didn't recognize low discrepancy method "
+                     "'{}'!".format(method))
+
+
+def hit_and_run(x0, constraint_matrix, bounds, n_samples, thin = 1,
+                random_state = None, burn_in = 0,
+                resync_interval = SLACK_RESYNC_INTERVAL, diagnostics = None,
+                target_ess = None):
     """A basic implementation of the hit and run sampler
 
+    The slack of each constraint, b - Ax, is updated with the step along the
+    chord rather than recalculated, and recalculated exactly every
+    resync_interval steps.
+
     :param x0: The starting value of sampler.
     :param constraint_matrix: A matrix of constraints in the form Ax <= b.
     :param bounds: A vector of bounds in the form Ax <= b.
     :param n_samples: The numbers of samples to return.
     :param thin: The thinning factor. Retain every 'thin' sample (e.g. if thin = 2, retain every 2nd sample)
+    :param random_state: The seed or generator to draw from, see :func:`check_random_state`.
+    :param burn_in: The number of steps to discard before the first sample.
+    :param resync_interval: The number of steps between exact recalculations of the slack,
+                            at least 1.
+    :param diagnostics: A :class:`ChainDiagnostics` for one chain, updated with every sample.
+    :param target_ess: Stop early once every coordinate has this effective sample size
+                       and a split R-hat below 1.01, which needs **diagnostics**.
+                       Fewer than n_samples are returned.
+    """
+    out_samples = np.zeros((n_samples, len(x0)))
+    count = 0
+    for chunk in iter_hit_and_run(x0, constraint_matrix, bounds, n_samples,
+                                  n_samples or 1, thin, random_state, burn_in,
+                                  resync_interval, out_samples, diagnostics,
+                                  target_ess):
+        count += len(chunk)
+
+    return(out_samples[:count])
+
+
+def iter_hit_and_run(x0, constraint_matrix, bounds, n_samples,
+                     chunk_size = CHUNK_SIZE, thin = 1, random_state = None,
+                     burn_in = 0, resync_interval = SLACK_RESYNC_INTERVAL,
+                     out = None, diagnostics = None, target_ess = None):
+    """Runs the hit and run sampler, returning the samples a chunk at a time.
+
+    This draws the same points as :func:`hit_and_run`, without holding more
+    than one chunk in memory.
+
+    :param chunk_size: The most samples in each chunk.
+    :param out: An optional (n_samples, p) array, e.g. a numpy.memmap, to
+                fill with the samples. The chunks are then views of it.
+    :returns: An iterator over arrays of up to chunk_size samples.
+
+    The other parameters are the same as for :func:`hit_and_run`.
+    """
+    if target_ess is not None and diagnostics is None:
+        raise ValueError("Stopping at a target effective sample size needs "
+                         "diagnostics")
+    x = np.array(x0, dtype=float)
+    steps = _HitAndRunSteps(x, constraint_matrix, bounds, random_state,
+                            resync_interval)
+    out = _check_out(out, (n_samples, len(x)))
+    return _iter_steps(steps, n_samples, chunk_size, thin, burn_in, out,
+                       diagnostics, target_ess)
+
+
+def hit_and_run_chains(x0, constraint_matrix, bounds, n_samples, thin = 1,
+                       random_state = None, burn_in = 0,
+                       resync_interval = SLACK_RESYNC_INTERVAL,
+                       diagnostics = None, target_ess = None):
+    """Runs several hit and run chains at once.
+
+    Each step moves every chain along its own random direction, so a step is a
+    few matrix operations on a (chains x p) array rather than a loop over the
+    chains. This is much faster than :func:`hit_and_run` when a large sample
+    is needed.
+
+    :param x0: The starting values of the chains, one chain per row.
+    :param constraint_matrix: A matrix of constraints in the form Ax <= b.
+    :param bounds: A vector of bounds in the form Ax <= b.
+    :param n_samples: The numbers of samples to return from each chain.
+    :param thin: The thinning factor. Retain every 'thin' sample (e.g. if thin = 2, retain every 2nd sample)
+    :param random_state: The seed or generator to draw from, see :func:`check_random_state`.
+    :param burn_in: The number of steps to discard before the first sample.
+    :param resync_interval: The number of steps between exact recalculations of the slack,
+                            at least 1.
+    :param diagnostics: A :class:`ChainDiagnostics` for the chains, updated with every sample.
+    :param target_ess: Stop early once every coordinate has this effective sample size over
+                       all of the chains and a split R-hat below 1.01, which needs
+                       **diagnostics**.
+    :returns: An array of shape (n_samples, chains, p), use
+              ``reshape(-1, p)`` to pool the chains.
+    """
+    x = np.array(x0, dtype=float, ndmin=2)
+    out_samples = np.zeros((n_samples,) + x.shape)
+    count = 0
+    for chunk in iter_hit_and_run_chains(x, constraint_matrix, bounds,
+                                         n_samples, n_samples or 1, thin,
+                                         random_state, burn_in,
+                                         resync_interval, out_samples,
+                                         diagnostics, target_ess):
+        count += len(chunk)
+
+    return(out_samples[:count])
+
+
+def iter_hit_and_run_chains(x0, constraint_matrix, bounds, n_samples,
+                            chunk_size = CHUNK_SIZE, thin = 1,
+                            random_state = None, burn_in = 0,
+                            resync_interval = SLACK_RESYNC_INTERVAL,
+                            out = None, diagnostics = None, target_ess = None):
+    """Runs several hit and run chains, returning the samples a chunk at a time.
+
+    This draws the same points as :func:`hit_and_run_chains`, without holding
+    more than one chunk in memory.
+
+    :param chunk_size: The most samples from each chain in each chunk.
+    :param out: An optional (n_samples, chains, p) array, e.g. a
+                numpy.memmap, to fill with the samples. The chunks are then
+                views of it.
+    :returns: An iterator over arrays of shape (up to chunk_size, chains, p).
+
+    The other parameters are the same as for :func:`hit_and_run_chains`.
+    """
+    if target_ess is not None and diagnostics is None:
+        raise ValueError("Stopping at a target effective sample size needs "
+                         "diagnostics")
+    x = np.array(x0, dtype=float, ndmin=2)
+    steps = _HitAndRunSteps(x, constraint_matrix, bounds, random_state,
+                            resync_interval)
+    out = _check_out(out, (n_samples,) + x.shape)
+    return _iter_steps(steps, n_samples, chunk_size, thin, burn_in, out,
+                       diagnostics, target_ess)
+
+
+def _iter_steps(steps, n_samples, chunk_size, thin, burn_in, out,
+                diagnostics, target_ess):
+    """Yields chunks of samples from hit and run steps."""
+    steps.advance(burn_in)
+    for start in range(0, n_samples, chunk_size):
+        count = min(chunk_size, n_samples - start)
+        if out is not None:
+            chunk = out[start:start + count]
+        else:
+            chunk = np.zeros((count,) + steps.x.shape)
+        if diagnostics is None:
+            steps.sample(chunk, thin)
+            yield chunk
+            continue
+        for i in range(0, count):
+            steps.advance(thin)
+            chunk[i] = steps.x
+            diagnostics.update(steps.x)
+            # the estimate only changes much once a batch is finished
+            if (target_ess is not None and diagnostics.batch_finished and
+                    diagnostics.converged(target_ess)):
+                yield chunk[:i + 1]
+                return
+        yield chunk
+
+
+class ChainDiagnostics(object):
+    r"""Online convergence diagnostics for one or more sampler chains.
+
+    Every update costs O(p) per chain (times **max_lag** for the
+    autocorrelations), so the diagnostics can be kept while sampling. The
+    effective sample size uses batch means: the chain is split into between
+    **batch_count** and twice that many batches, and adjacent batches are
+    merged as the chain grows. The potential scale reduction factor is the
+    split :math:`\hat{R}` of Gelman et al., from the first and second
+    halves of the batches of every chain.
+
+    :param chain_count: The number of chains.
+    :param p: The number of coordinates in each sample.
+    :param max_lag: The most lags to keep autocorrelations for.
+    :param batch_count: The least number of batches for the batch means.
+    """
+
+    def __init__(self, chain_count, p, max_lag = 10, batch_count = 32):
+        self.chain_count = chain_count
+        self.p = p
+        self.max_lag = max_lag
+        self.batch_count = batch_count
+        self.n = 0
+
+        shape = (chain_count, p)
+        # samples are shifted by the first ones to limit cancellation
+        self._shift = None
+        self._sum = np.zeros(shape)
+        self._mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+        self._head = np.zeros((max_lag,) + shape)
+        self._recent = np.zeros((max_lag,) + shape)
+        self._lag_sums = np.zeros((max_lag,) + shape)
+
+        self.batch_size = 1
+        self._batches = 0
+        self._batch_sums = np.zeros((2 * batch_count,) + shape)
+        self._batch_squares = np.zeros((2 * batch_count,) + shape)
+        self._partial_sum = np.zeros(shape)
+        self._partial_square = np.zeros(shape)
+        self._partial_count = 0
+        self.batch_finished = False
+
+    def update(self, x):
+        """Adds a sample from every chain, as a (chains x p) array."""
+        x = np.reshape(x, (self.chain_count, self.p))
+        if self._shift is None:
+            # the same shift for every chain keeps the differences in their
+            # means
+            self._shift = np.mean(x, axis=0)
+        x = x - self._shift
+
+        # Welford's running mean and variance
+        self.n += 1
+        delta = x - self._mean
+        self._mean += delta / self.n
+        self._m2 += delta * (x - self._mean)
+        self._sum += x
+
+        # the products with the last max_lag samples
+        lags = min(self.n - 1, self.max_lag)
+        for k in range(1, lags + 1):
+            self._lag_sums[k - 1] += x * self._recent[(self.n - 1 - k) %
+                                                      self.max_lag]
+        if self.max_lag:
+            self._recent[(self.n - 1) % self.max_lag] = x
+            if self.n <= self.max_lag:
+                self._head[self.n - 1] = x
+
+        self._partial_sum += x
+        self._partial_square += x * x
+        self._partial_count += 1
+        self.batch_finished = self._partial_count == self.batch_size
+        if self.batch_finished:
+            self._batch_sums[self._batches] = self._partial_sum
+            self._batch_squares[self._batches] = self._partial_square
+            self._batches += 1
+            self._partial_sum[:] = 0
+            self._partial_square[:] = 0
+            self._partial_count = 0
+            if self._batches == 2 * self.batch_count:
+                self._merge_batches()
+
+    def _merge_batches(self):
+        """Halves the number of batches by adding adjacent pairs."""
+        for batches in [self._batch_sums, self._batch_squares]:
+            batches[:self.batch_count] = batches[0::2] + batches[1::2]
+            batches[self.batch_count:] = 0
+        self._batches = self.batch_count
+        self.batch_size *= 2
+
+    @property
+    def ready(self):
+        """True once there are enough batches for the estimates."""
+        return self._batches >= self.batch_count
+
+    def variance(self):
+        """Returns the sample variance of each coordinate of each chain."""
+        return self._m2 / max(self.n - 1, 1)
+
+    def autocorrelation(self):
+        """Returns the autocorrelations of each coordinate.
+
+        :returns: A (max_lag x p) array of the autocorrelations at lags 1 to
+                  max_lag, averaged over the chains.
+        """
+        lags = min(self.max_lag, self.n - 1)
+        result = np.full((self.max_lag, self.p), np.nan)
+        mean = self._mean
+        for k in range(1, lags + 1):
+            # the sums of x[t] for t >= k and of x[t - k]
+            later = self._sum - np.sum(self._head[:k], axis=0)
+            recent = [(self.n - j) % self.max_lag for j in range(1, k + 1)]
+            earlier = self._sum - np.sum(self._recent[recent], axis=0)
+            autocovariance = (self._lag_sums[k - 1] -
+                              mean * (later + earlier) +
+                              (self.n - k) * mean * mean) / self.n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlation = autocovariance / (self._m2 / self.n)
+            result[k - 1] = np.mean(correlation, axis=0)
+        return result
+
+    def effective_sample_size(self):
+        """Returns the effective sample size of each coordinate.
+
+        The batch means of every chain are compared with the mean over all of
+        the chains, so chains that are stuck in different places have a small
+        effective sample size even if each one mixes well on its own.
+
+        :returns: An array of the batch means estimates over all of the
+                  chains.
+        """
+        if self._batches < 2:
+            return np.zeros(self.p)
+        count = self._batches * self.batch_size * self.chain_count
+        batch_sums = self._batch_sums[:self._batches]
+        mean = np.sum(batch_sums, axis=(0, 1)) / count
+        squares = np.sum(self._batch_squares[:self._batches], axis=(0, 1))
+        variance = (squares - count * mean * mean) / (count - 1)
+        # the variance of the batch means about the pooled mean
+        means = batch_sums / self.batch_size
+        between = (np.sum((means - mean) ** 2, axis=(0, 1)) /
+                   (self._batches * self.chain_count - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ess = count * variance / (self.batch_size * between)
+        # a constant coordinate needs no more samples
+        ess[between == 0] = count
+        return np.minimum(ess, count)
+
+    def converged(self, target_ess):
+        """True once the chains have mixed and have enough samples.
+
+        That is every coordinate has an effective sample size of at least
+        target_ess and a split R-hat below RHAT_THRESHOLD.
+        """
+        return (self.ready and
+                np.min(self.effective_sample_size()) >= target_ess and
+                np.max(self.split_rhat()) < RHAT_THRESHOLD)
+
+    def split_rhat(self):
+        """Returns the split potential scale reduction factor of each coordinate.
+
+        Values close to 1 show that the chains have mixed.
+        """
+        half = self._batches // 2
+        if half < 1 or half * self.batch_size < 2:
+            return np.full(self.p, np.nan)
+        halves = [slice(0, half), slice(self._batches - half, self._batches)]
+        count = half * self.batch_size
+        means = []
+        variances = []
+        for part in halves:
+            total = np.sum(self._batch_sums[part], axis=0)
+            squares = np.sum(self._batch_squares[part], axis=0)
+            mean = total / count
+            means.append(mean)
+            variances.append((squares - count * mean * mean) / (count - 1))
+        means = np.concatenate(means)
+        within = np.mean(np.concatenate(variances), axis=0)
+        between = count * np.var(means, axis=0, ddof=1)
+        pooled = (count - 1) / count * within + between / count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(pooled / within)
+
+
+def remove_redundant_constraints(constraint_matrix, bounds, tolerance = 1e-9):
+    """Drops the constraints that don't change a polytope.
+
+    A constraint is redundant if it can't be violated when all of the other
+    constraints that are kept hold, which is checked with a linear program
+    per constraint. Redundant constraints only slow down each sampler step.
+
+    :param constraint_matrix: A matrix of constraints in the form Ax <= b.
+    :param bounds: A vector of bounds in the form Ax <= b.
+    :param tolerance: How far a constraint must be from binding to be kept.
+    :returns: A tuple of the constraint matrix and bounds that are kept.
+    """
+    constraint_matrix = np.asarray(constraint_matrix, dtype=float)
+    bounds = np.asarray(bounds, dtype=float)
+
+    keep = np.ones(len(bounds), dtype=bool)
+    for i in range(0, len(bounds)):
+        keep[i] = False
+        # maximize the constraint over the others, relaxed by one so the
+        # problem is bounded whenever the polytope is
+        result = scipy.optimize.linprog(
+            -constraint_matrix[i],
+            A_ub=np.vstack((constraint_matrix[keep], constraint_matrix[i])),
+            b_ub=np.append(bounds[keep], bounds[i] + 1),
+            bounds=(None, None))
+        if result.status != 0 or -result.fun > bounds[i] + tolerance:
+            keep[i] = True
+
+    return constraint_matrix[keep], bounds[keep]
+
+
+def chebyshev_center(constraint_matrix, bounds):
+    """Finds the center of the largest ball inside a polytope.
+
+    This is a good starting point for :func:`hit_and_run`, it is as far as
+    possible from every constraint.
+
+    :param constraint_matrix: A matrix of constraints in the form Ax <= b.
+    :param bounds: A vector of bounds in the form Ax <= b.
+    :returns: A tuple of the center and the radius of the ball.
+    """
+    constraint_matrix = np.asarray(constraint_matrix, dtype=float)
+    bounds = np.asarray(bounds, dtype=float)
+    p = constraint_matrix.shape[1]
+
+    # maximize r subject to a'x + |a| r <= b for every constraint
+    norms = np.linalg.norm(constraint_matrix, axis=1)
+    cost = np.zeros(p + 1)
+    cost[-1] = -1
+    result = scipy.optimize.linprog(
+        cost, A_ub=np.column_stack((constraint_matrix, norms)), b_ub=bounds,
+        bounds=[(None, None)] * p + [(0, None)])
+    if result.status == 3:
+        raise ValueError("The constraints don't bound the region")
+    if result.status != 0 or result.x[-1] <= 0:
+        raise ValueError("The constraints don't have a feasible interior")
+
+    return result.x[:p], result.x[-1]
+
+
+def round_polytope(constraint_matrix, bounds, x0, sample_count = None,
+                   random_state = None):
+    """Transforms a polytope so that it is roughly round.
+
+    Hit and run mixes slowly in long, thin regions. This estimates the shape
+    of the region from a pilot run of the sampler started at x0, and returns
+    the constraints on y for the transformation x = x0 + Ty that makes the
+    sample covariance the identity.
+
+    :param x0: A point in the interior of the polytope, e.g. its
+               :func:`chebyshev_center`.
+    :param sample_count: The length of the pilot run, defaults to 100 steps
+                         per dimension.
+    :param random_state: The seed or generator to draw from, see :func:`check_random_state`.
+    :returns: A tuple of the constraint matrix and bounds on y, and T.
     """
-    x = np.copy(x0)
-    p = len(x)
+    constraint_matrix = np.asarray(constraint_matrix, dtype=float)
+    bounds = np.asarray(bounds, dtype=float)
+    x0 = np.asarray(x0, dtype=float)
+    p = len(x0)
+    if sample_count is None:
+        sample_count = 100 * p
 
-    out_samples = np.zeros((n_samples, p))
+    pilot = hit_and_run(x0, constraint_matrix, bounds, sample_count,
+                        random_state=random_state)
+    covariance = np.atleast_2d(np.cov(pilot, rowvar=False))
+    transform = np.linalg.cholesky(covariance)
 
-    for i in range(0, n_samples):
-        thin_count = 0
+    return (np.dot(constraint_matrix, transform),
+            bounds - np.dot(constraint_matrix, x0), transform)
 
-        while thin_count < thin:
-            thin_count = thin_count + 1
 
-            random_dir = np.random.normal(0.0, 1.0, p)
-            random_dir = random_dir / np.linalg.norm(random_dir)
+def sample_polytope(constraint_matrix, bounds, n_samples, thin = 1,
+                    random_state = None, burn_in = 0, rounding = False):
+    """Samples a polytope uniformly with hit and run after preprocessing it.
+
+    Redundant constraints are dropped, the chain starts at the Chebyshev
+    center, and the polytope is optionally rounded first, see
+    :func:`round_polytope`.
+
+    :param constraint_matrix: A matrix of constraints in the form Ax <= b.
+    :param bounds: A vector of bounds in the form Ax <= b.
+    :param n_samples: The numbers of samples to return.
+    :param thin: The thinning factor, see :func:`hit_and_run`.
+    :param random_state: The seed or generator to draw from, see :func:`check_random_state`.
+    :param burn_in: The number of steps to discard before the first sample.
+    :param rounding: If True, sample the rounded polytope.
+    """
+    rng = check_random_state(random_state)
+    (constraint_matrix, bounds) = remove_redundant_constraints(
+        constraint_matrix, bounds)
+    (center, _) = chebyshev_center(constraint_matrix, bounds)
+    if not rounding:
+        return hit_and_run(center, constraint_matrix, bounds, n_samples, thin,
+                           rng, burn_in)
+
+    (rounded_matrix, rounded_bounds, transform) = round_polytope(
+        constraint_matrix, bounds, center, random_state=rng)
+    sample = hit_and_run(np.zeros(len(center)), rounded_matrix,
+                         rounded_bounds, n_samples, thin, rng, burn_in)
+    return center + np.dot(sample, transform.T)
+
+
+class _HitAndRunSteps(object):
+    """Moves hit and run chains, one chain per row of x.
+
+    A single chain can be given as a 1-D x, which is stepped without the
+    per-row reductions.
+    """
+
+    def __init__(self, x, constraint_matrix, bounds, random_state,
+                 resync_interval):
+        if resync_interval < 1:
+            raise ValueError("The slack resync interval must be at least 1, "
+                             "not {}".format(resync_interval))
+        self.rng = check_random_state(random_state)
+        self.x = x
+        self.constraint_matrix = np.asarray(constraint_matrix, dtype=float)
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.resync_interval = resync_interval
+        self.slack = self.bounds - np.dot(x, self.constraint_matrix.T)
+        self.step_count = 0
+
+    def advance(self, steps):
+        """Moves every chain the given number of steps."""
+        if self.x.ndim == 1:
+            self._walk(steps)
+            return
+        chain_count, p = self.x.shape
+        for _ in range(0, steps):
+            random_dir = self.rng.normal(0.0, 1.0, (chain_count, p))
+            random_dir /= np.linalg.norm(random_dir, axis=1)[:, np.newaxis]
+
+            denom = np.dot(random_dir, self.constraint_matrix.T)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                intersections = self.slack / denom
+            t_low = np.max(np.where(denom < 0, intersections, -np.inf), axis=1)
+            t_high = np.min(np.where(denom > 0, intersections, np.inf), axis=1)
+
+            u = self.rng.uniform(0, 1, chain_count)
+            random_distance = t_low + u * (t_high - t_low)
+            self.x += random_distance[:, np.newaxis] * random_dir
+
+            self.step_count += 1
+            if self.step_count % self.resync_interval == 0:
+                self.slack = (self.bounds -
+                              np.dot(self.x, self.constraint_matrix.T))
+            else:
+                self.slack -= random_distance[:, np.newaxis] * denom
+
+    def sample(self, out, thin):
+        """Fills out with the position after every thin steps."""
+        if self.x.ndim == 1:
+            self._walk(len(out) * thin, out, thin)
+            return
+        for i in range(0, len(out)):
+            self.advance(thin)
+            out[i] = self.x
+
+    def _walk(self, steps, out = None, thin = 1):
+        """Moves a single chain, optionally keeping every thin position."""
+        rng = self.rng
+        constraint_matrix = self.constraint_matrix
+        x = self.x
+        slack = self.slack
+        p = len(x)
+        for i in range(0, steps):
+            random_dir = rng.normal(0.0, 1.0, p)
+            random_dir /= np.linalg.norm(random_dir)
 
             denom = constraint_matrix.dot(random_dir)
-            intersections = (bounds - constraint_matrix.dot(x)) / denom
-            t_low  = np.max(intersections[denom < 0])
-            t_high  = np.min(intersections[denom > 0])
+            intersections = slack / denom
+            t_low = np.max(intersections[denom < 0])
+            t_high = np.min(intersections[denom > 0])
 
-            u = np.random.uniform(0, 1)
+            u = rng.uniform(0, 1)
             random_distance = t_low + u * (t_high - t_low)
-            x_new = x + random_distance * random_dir
+            x += random_distance * random_dir
+
+            self.step_count += 1
+            if self.step_count % self.resync_interval == 0:
+                slack = self.bounds - constraint_matrix.dot(x)
+            else:
+                slack -= random_distance * denom
+
+            if out is not None and (i + 1) % thin == 0:
+                out[i // thin] = x
+        self.slack = slack
 
-        out_samples[i, ] = x_new
-        x = x_new
 
-    return(out_samples)
+def _check_out(out, shape):
+    """Checks that a caller's output array has the right shape."""
+    if out is not None and out.shape != shape:
+        raise ValueError("The output array has shape {}, expected "
+                         "{}".format(out.shape, shape))
+    return out
@@ -1,7 +1,10 @@
 from __future__ import division
-from unittest import TestCase
+from unittest import TestCase, mock
 
-from dexpy.alias import alias_list
+from dexpy.alias import alias_list, regular_alias_list
+from dexpy.alias import defining_words, resolution, estimable_columns
+from dexpy.alias import AliasMatrix
+from dexpy.factorial import build_factorial
 import dexpy.design as design
 import pandas as pd
 import numpy as np
@@ -62,3 +65,105 @@ class TestAliases(TestCase):
                                 np.allclose(abs(alias_coefs[r, c]), 1/3),
                                 "Expected 1, 0 or 1/3 for plackett-burman "
                                 "alias, was {}".format(alias_coefs[r, c]))
+
+
+class TestAliasMatrix(TestCase):
+
+    def test_labels(self):
+        """Tests the alias matrix rows and columns are labelled."""
+        factor_data = build_factorial(4, 8)
+        aliases, alias_coefs = alias_list("(X1+X2+X3+X4)**2", factor_data)
+        frame = alias_coefs.to_frame()
+        self.assertEqual(alias_coefs.estimated, list(frame.index))
+        self.assertEqual(alias_coefs.terms, list(frame.columns))
+        self.assertEqual(['Intercept', 'X1', 'X2', 'X3', 'X4', 'X1:X2',
+                          'X1:X3', 'X1:X4'], alias_coefs.estimated)
+        self.assertAlmostEqual(1, frame.loc["X1:X2", "X3:X4"])
+        self.assertEqual(0, frame.loc["X1:X2", "X1:X3"])
+        self.assertFalse(frame.isna().any().any())
+        np.testing.assert_allclose(alias_coefs.toarray(),
+                                   np.asarray(alias_coefs))
+
+    def test_estimable_columns(self):
+        """Tests the earliest independent columns are estimated."""
+        model_matrix = np.array([[1, -1, -1, 1],
+                                 [1, 1, 1, -1],
+                                 [1, -1, -1, 1],
+                                 [1, 1, 1, -1]])
+        self.assertEqual([0, 1], estimable_columns(model_matrix, 1e-8))
+        # an interaction aliased with a main effect in 6 factors, 16 runs
+        factor_data = build_factorial(6, 16)
+        model = "({})**2".format("+".join(factor_data.columns))
+        aliases, alias_coefs = alias_list(model, factor_data)
+        self.assertEqual(14, alias_coefs.shape[0])
+        self.assertEqual('X1:X2 = X3:X5', aliases[0])
+
+    def test_lazy(self):
+        """Tests the alias strings are only formatted when read."""
+        factor_data = build_factorial(4, 8)
+        aliases, alias_coefs = alias_list("(X1+X2+X3+X4)**2", factor_data)
+        with mock.patch.object(AliasMatrix, "alias_string",
+                               autospec=True,
+                               side_effect=AliasMatrix.alias_string) as fmt:
+            self.assertEqual(3, len(aliases))
+            self.assertEqual(0, fmt.call_count)
+            aliases[1]
+            self.assertEqual(1, fmt.call_count)
+        self.assertEqual('X1:X4 = X2:X3', aliases[-1])
+        self.assertEqual(['X1:X2 = X3:X4', 'X1:X3 = X2:X4'], aliases[:2])
+        self.assertEqual(['X1:X2 = X3:X4', 'X1:X3 = X2:X4', 'X1:X4 = X2:X3'],
+                         aliases)
+
+
+class TestRegularAliases(TestCase):
+
+    def test_matches_numeric(self):
+        """Tests the algebraic aliases match the numeric ones."""
+        for factor_count, run_count, generators in [
+                (5, 16, ["E=ABCD"]),
+                (6, 8, ["D=AB", "E=AC", "F=BC"]),
+                (6, 16, ["E=ABC", "F=BCD"]),
+                (7, 8, ["D=AB", "E=AC", "F=BC", "G=ABC"]),
+                (9, 16, ["E=ABC", "F=BCD", "G=ACD", "H=ABD", "J=ABCD"])]:
+            factor_data = build_factorial(factor_count, run_count)
+            model = "({})**2".format("+".join(factor_data.columns))
+
+            aliases, alias_coefs = alias_list(model, factor_data)
+            regular, regular_coefs = regular_alias_list(model, generators,
+                                                        factor_count)
+            self.assertEqual(aliases, regular)
+            np.testing.assert_allclose(alias_coefs, regular_coefs,
+                                       atol=1e-8)
+
+            # the design's generators take the fast path
+            self.assertEqual(aliases, alias_list(model, factor_data,
+                                                 generators)[0])
+
+    def test_half_fraction(self):
+        """Tests the aliases of a 2^(4-1) design."""
+        aliases, alias_coefs = regular_alias_list("(X1+X2+X3+X4)**3",
+                                                  ["D=ABC"], 4)
+        answer = [
+            'X1 = X2:X3:X4', 'X2 = X1:X3:X4', 'X3 = X1:X2:X4',
+            'X4 = X1:X2:X3', 'X1:X2 = X3:X4', 'X1:X3 = X2:X4',
+            'X1:X4 = X2:X3'
+        ]
+        self.assertEqual(answer, aliases)
+        self.assertEqual((8, 15), alias_coefs.shape)
+
+    def test_defining_relation(self):
+        """Tests the defining relation and resolution of a 2^(7-2) design."""
+        generators = ["F=ABCD", "G=ABDE"]
+        self.assertEqual(['X3:X5:X6:X7', 'X1:X2:X3:X4:X6', 'X1:X2:X4:X5:X7'],
+                         defining_words(generators, 7))
+        self.assertEqual(4, resolution(generators, 7))
+        self.assertEqual(3, resolution(["D=AB", "E=AC", "F=BC"], 6))
+        self.assertIsNone(resolution([], 3))
+
+    def test_not_a_word(self):
+        """Tests that terms other than products of factors fall back."""
+        factor_data = build_factorial(4, 8)
+        model = "X1+X2+X3+X4+I(X1**2)"
+        self.assertRaises(ValueError, regular_alias_list, model, ["D=ABC"], 4)
+        aliases, _ = alias_list(model, factor_data, ["D=ABC"])
+        self.assertEqual(["Intercept = I(X1 ** 2)"], aliases)
@@ -18,3 +18,10 @@ class TestDesign(TestCase):
         # not really valid ids, but we wrap around rather than error
         self.assertEqual('Z', design.get_var_name(-1))
         self.assertEqual('A"', design.get_var_name(75))
+
+    def test_var_id(self):
+        """Tests that design converts chars back into variable ids."""
+        for var_id in range(75):
+            name = design.get_var_name(var_id)
+            self.assertEqual(var_id, design.get_var_id(name))
+        self.assertRaises(ValueError, design.get_var_id, "AB")
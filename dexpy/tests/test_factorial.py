@@ -1,7 +1,40 @@
 from unittest import TestCase
+import itertools
+import json
+import os
+import re
+import tempfile
+import numpy as np
 
 from dexpy.factorial import build_factorial
+from dexpy.factorial import build_full_factorial, iter_full_factorial
+from dexpy.factorial import parse_generators, defining_relation
+from dexpy.factorial import word_length_pattern, minimum_aberration_generators
 from dexpy.alias import alias_list
+import dexpy.design as design
+
+class TestFullFactorial(TestCase):
+
+    def test_standard_order(self):
+        """Checks the bit pattern runs match every combination in order."""
+        for factor_count in range(1, 6):
+            answer = list(itertools.product([-1, 1], repeat=factor_count))
+            result = build_full_factorial(factor_count)
+            self.assertEqual(np.int64, result.dtype)
+            np.testing.assert_array_equal(answer, result)
+
+        # user arithmetic on the design doesn't overflow
+        X = build_full_factorial(8)
+        np.testing.assert_array_equal(256 * np.identity(8), np.dot(X.T, X))
+        self.assertEqual(256, np.sum(X * X, axis=0)[0])
+
+    def test_chunks(self):
+        """Checks the chunks join up to the full design."""
+        chunks = list(iter_full_factorial(7, chunk_size=50))
+        self.assertEqual([50, 50, 28], [len(c) for c in chunks])
+        self.assertEqual(np.int8, chunks[0].dtype)
+        np.testing.assert_array_equal(build_full_factorial(7),
+                                      np.vstack(chunks))
 
 class TestFactorial(TestCase):
 
@@ -117,3 +150,139 @@ class TestFactorial(TestCase):
         ]
 
         self.assertEqual(answer_aliases, aliases)
+
+    def test_generators(self):
+        """Tests a 2^(40-24) design built from explicit generators."""
+        names = [design.get_var_name(i) for i in range(40)]
+        generators = []
+        for i in range(24):
+            word = "".join(names[j] for j in range(16) if (7 * j + i) % 3)
+            generators.append("{}={}".format(names[16 + i], word))
+
+        result = build_factorial(40, 2**16, generators)
+        self.assertEqual((2**16, 40), result.shape)
+        self.assertTrue((result.dtypes == np.int64).all())
+        # user arithmetic on the design doesn't overflow
+        self.assertEqual(150, (build_factorial(3, 8) * 50 + 100).values.max())
+        for i, gen in enumerate(generators):
+            cols = [design.get_var_id(v) for v in re.findall("[A-Z]'?", gen[2:])]
+            np.testing.assert_array_equal(result.iloc[:, cols].product(axis=1),
+                                          result.iloc[:, 16 + i])
+
+    def test_bad_generators(self):
+        """Tests that invalid run counts and generators are rejected."""
+        self.assertRaises(ValueError, build_factorial, 4, 12)
+        self.assertRaises(ValueError, build_factorial, 4, 32)
+        self.assertRaises(ValueError, build_factorial, 5, 8, ["D=AB"])
+        self.assertRaises(ValueError, build_factorial, 5, 8, ["D=AB", "D=AC"])
+        self.assertRaises(ValueError, build_factorial, 5, 8, ["D=AB", "E=AD"])
+        self.assertRaises(ValueError, build_factorial, 5, 8, ["D=AB", "E=A-C"])
+        self.assertRaises(ValueError, build_factorial, 16, 16)
+
+
+class TestMinimumAberration(TestCase):
+
+    def word_length_pattern(self, generators, factor_count, run_count):
+        """Returns the word length pattern of a fraction's generators."""
+        full_factor_count = run_count.bit_length() - 1
+        words = parse_generators(generators, full_factor_count, factor_count)
+        words = [word | 1 << (full_factor_count + i)
+                 for i, word in enumerate(words)]
+        return word_length_pattern(words, factor_count)
+
+    def test_defining_relation(self):
+        """Tests the defining relation of a 2^(7-2) design."""
+        words = parse_generators(["F=ABCD", "G=ABDE"], 5, 7)
+        words = [words[0] | 1 << 5, words[1] | 1 << 6]
+        relation = defining_relation(words)
+        # I = ABCDF = ABDEG = CEFG
+        self.assertEqual([0b0101111, 0b1011011, 0b1110100], list(relation))
+        np.testing.assert_array_equal([0, 0, 0, 0, 1, 2, 0, 0],
+                                      word_length_pattern(words, 7))
+
+    def test_search(self):
+        """Tests the search finds designs as good as the stored ones."""
+        for factor_count, run_count in [(6, 16), (7, 32), (9, 32), (10, 64),
+                                        (12, 16), (11, 128)]:
+            stored = build_factorial(factor_count, run_count)
+            generators = minimum_aberration_generators(factor_count,
+                                                       run_count,
+                                                       cache_path=None)
+            found = build_factorial(factor_count, run_count, generators)
+            self.assertEqual(stored.shape, found.shape)
+
+            # compare the patterns from A3 on, smaller is less aberration
+            stored_pattern = np.zeros(factor_count + 1, dtype=int)
+            for word in range(1, 2 ** factor_count):
+                letters = [i for i in range(factor_count) if word >> i & 1]
+                if np.all(stored.iloc[:, letters].product(axis=1) == 1):
+                    stored_pattern[len(letters)] += 1
+            found_pattern = self.word_length_pattern(generators,
+                                                     factor_count, run_count)
+            self.assertLessEqual(tuple(found_pattern[3:]),
+                                 tuple(stored_pattern[3:]))
+
+    def test_cache(self):
+        """Tests searched generators are saved and reused."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "dexpy", "generators.json")
+            generators = minimum_aberration_generators(
+                23, 64, cache_path=cache_path)
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            self.assertEqual({"beam_search": {"23,64,10": generators}}, cache)
+
+            # a saved entry is returned without searching
+            cache["beam_search"]["23,64,10"] = ["not searched"]
+            with open(cache_path, "w") as cache_file:
+                json.dump(cache, cache_file)
+            self.assertEqual(["not searched"], minimum_aberration_generators(
+                23, 64, cache_path=cache_path))
+
+            # other sections of the cache are kept when it is saved
+            with open(cache_path, "w") as cache_file:
+                json.dump({"other": {"a": 1}}, cache_file)
+            self.assertEqual(generators, minimum_aberration_generators(
+                23, 64, cache_path=cache_path))
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            self.assertEqual({"other": {"a": 1},
+                              "beam_search": {"23,64,10": generators}}, cache)
+
+    def test_build_cache_path(self):
+        """Tests build_factorial saves searched generators where it is told."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "generators.json")
+            searched = build_factorial(23, 64, cache_path=cache_path)
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            generators = cache["beam_search"]["23,64,10"]
+            np.testing.assert_array_equal(
+                build_factorial(23, 64, generators).values, searched.values)
+
+            # without a cache nothing is written
+            uncached = build_factorial(23, 64, cache_path=None)
+            np.testing.assert_array_equal(searched.values, uncached.values)
+            self.assertEqual(["generators.json"], os.listdir(directory))
+
+    def test_resolution_iv(self):
+        """Tests the search doesn't settle for resolution III.
+
+        Up to run_count / 2 factors there is always a resolution IV design.
+        """
+        for factor_count, run_count in [(22, 64), (28, 128)]:
+            generators = minimum_aberration_generators(factor_count,
+                                                       run_count,
+                                                       cache_path=None)
+            pattern = self.word_length_pattern(generators, factor_count,
+                                               run_count)
+            self.assertEqual(0, pattern[3])
+            self.assertGreater(pattern[4], 0)
+
+    def test_saturated(self):
+        """Tests the largest resolution III design and one factor too many."""
+        generators = minimum_aberration_generators(15, 16, cache_path=None)
+        pattern = self.word_length_pattern(generators, 15, 16)
+        self.assertEqual(2 ** 11 - 1, np.sum(pattern))
+        self.assertEqual(35, pattern[3])
+        self.assertRaises(ValueError, minimum_aberration_generators, 16, 16)
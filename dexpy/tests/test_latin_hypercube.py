@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from dexpy.latin_hypercube import build_latin_hypercube, phi_p
+from dexpy.latin_hypercube import latin_hypercube_start
+
+class TestLatinHypercube(unittest.TestCase):
+    """Tests for building space-filling Latin hypercube designs."""
+
+    def check_latin(self, points, run_count):
+        """Checks that every column has each of the run_count levels once."""
+        levels = (2 * np.arange(run_count) + 1) / run_count - 1
+        for column in np.asarray(points).T:
+            np.testing.assert_allclose(np.sort(column), levels)
+
+    def test_shape(self):
+        """Builds a 3 factor, 12 run design and checks it is a Latin hypercube."""
+        design = build_latin_hypercube(3, 12, random_state=1)
+        self.assertEqual(design.shape, (12, 3))
+        self.assertEqual(list(design.columns), ["X1", "X2", "X3"])
+        self.check_latin(design, 12)
+
+    def test_improves(self):
+        """Checks the optimized design is more space-filling than the start."""
+        start, _ = latin_hypercube_start(4, 30, 50, 0, 20, seed=3)
+        points, phi = latin_hypercube_start(4, 30, 50, 2000, 20, seed=3)
+        self.check_latin(points, 30)
+        self.assertLess(phi, phi_p(start))
+
+    def test_incremental(self):
+        """Checks the tracked distances agree with the returned criterion."""
+        points, phi = latin_hypercube_start(5, 25, 20, 1000, 10, seed=7)
+        self.assertAlmostEqual(phi, phi_p(points, 20))
+
+    def test_phi_p(self):
+        """Checks phi_p against a hand calculation."""
+        points = np.array([[0, 0], [1, 0], [0, 2]])
+        distances = np.array([1, 2, np.sqrt(5)])
+        answer = np.sum(distances ** -2.0) ** 0.5
+        self.assertAlmostEqual(phi_p(points, 2), answer)
+
+    def test_reproducible(self):
+        """Checks a seeded build repeats, including with parallel starts."""
+        first = build_latin_hypercube(2, 10, random_state=5)
+        second = build_latin_hypercube(2, 10, random_state=5)
+        np.testing.assert_array_equal(first, second)
+
+        serial = build_latin_hypercube(2, 10, n_starts=3, random_state=5)
+        parallel = build_latin_hypercube(2, 10, n_starts=3, n_jobs=2,
+                                         random_state=5)
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_too_few_runs(self):
+        """Checks that a single run is rejected."""
+        self.assertRaises(ValueError, build_latin_hypercube, 2, 1)
@@ -4,6 +4,7 @@ import math
 import dexpy.design as design
 import numpy as np
 import pandas as pd
+from dexpy.model import ModelExpander
 
 class TestModelMatrix(TestCase):
     """Tests for generating a model matrix"""
@@ -27,3 +28,17 @@ class TestModelMatrix(TestCase):
         factor_data = pd.DataFrame(factor_data, columns=design.get_factor_names(len(factor_data[0])))
         X = design.create_model_matrix(factor_data, "1 + X1 + X2 + X1:X2 + I(X1**2) + I(X2**2)")
         np.testing.assert_almost_equal([1.0, axial_pt, 0.0, -0.0, pow(axial_pt, 2), 0.0], X[5])
+
+    @classmethod
+    def test_expander(cls):
+        """Test that the compiled expander matches patsy for several terms"""
+        factor_names = design.get_factor_names(3)
+        factor_data = pd.DataFrame([[-1, 0.5, 1],
+                                    [0.25, -0.5, 0],
+                                    [1, 1, -0.75]], columns=factor_names)
+        model = "(X1+X2+X3)**2 + pow(X1, 2) + I(X2**3) + I(1/X2)"
+        X = design.create_model_matrix(factor_data, model)
+
+        expand = ModelExpander(X.design_info, factor_names)
+        np.testing.assert_almost_equal(X, expand(factor_data.values))
+        np.testing.assert_almost_equal(X[1:2], expand(factor_data.values[1]))
@@ -1,8 +1,17 @@
+from __future__ import division
+import warnings
 from unittest import TestCase
 from patsy import dmatrix
 import numpy as np
-from dexpy.optimal import build_optimal
+import numpy.polynomial.polynomial as npp
+import pandas as pd
+from dexpy.optimal import build_optimal, build_candidate_optimal, moment_matrix
+from dexpy.optimal import augment_optimal, OptimalBuildReport
+from dexpy.optimal import LOptimality, DOptimality, maximize_rational
+from dexpy.optimal import polynomial_coefficients, refactor
+from dexpy.model import ModelExpander
 from dexpy.model import make_model, ModelOrder
+from dexpy.design import get_factor_names
 
 class TestOptimal(TestCase):
 
@@ -69,3 +78,443 @@ class TestOptimal(TestCase):
 
         self.assertTrue(caught_error)
 
+
+    def test_multiple_starts(self):
+        """Tests that a multi-start build keeps the best start and is repeatable."""
+        optimal_data, stats = build_optimal(3, order=ModelOrder.quadratic,
+                                            n_starts=4, n_jobs=2,
+                                            random_state=1234,
+                                            return_stats=True)
+        self.assertEqual(4, len(stats))
+
+        model = make_model(optimal_data.columns, ModelOrder.quadratic, True)
+        X = dmatrix(model, optimal_data)
+        _, logdet = np.linalg.slogdet(np.linalg.inv(np.dot(np.transpose(X), X)))
+        best = min([s['d_optimality'] for s in stats])
+        self.assertAlmostEqual(best, logdet, places=6)
+
+        # the same seed gives the same design, regardless of the process count
+        serial_data = build_optimal(3, order=ModelOrder.quadratic,
+                                    n_starts=4, n_jobs=1, random_state=1234)
+        np.testing.assert_array_equal(optimal_data.values, serial_data.values)
+
+    def test_saturated_i_optimal(self):
+        """Tests that I-optimal exchanges never make the design singular."""
+        for coordinate_search in ["grid", "continuous"]:
+            optimal_data, stats = build_optimal(
+                2, order=ModelOrder.quadratic, criterion="I", n_starts=10,
+                random_state=2, coordinate_search=coordinate_search,
+                return_stats=True)
+            for start_stats in stats:
+                self.assertGreater(start_stats['value'], 0)
+                self.assertLess(start_stats['value'], 10)
+
+            model = make_model(optimal_data.columns, ModelOrder.quadratic, True)
+            X = dmatrix(model, optimal_data)
+            self.assertEqual(6, np.linalg.matrix_rank(X))
+
+    def test_refactor(self):
+        """Tests that the variance matrix is recalculated on schedule."""
+        _, stats = build_optimal(3, order=ModelOrder.quadratic, run_count=14,
+                                 refactor_interval=5, random_state=7,
+                                 return_stats=True)
+        # every 5 swaps, after each pass that made any and after swaps that
+        # improve an ill-conditioned random start a lot
+        passes = len(stats[0]['passes']) - 1
+        self.assertLessEqual(stats[0]['swaps'] // 5 + passes,
+                             stats[0]['refactorizations'])
+        self.assertLessEqual(stats[0]['refactorizations'],
+                             stats[0]['swaps'] + passes)
+        self.assertLess(stats[0]['drift'], 1e-6)
+
+        # this start is nearly singular, updating from it without refactoring
+        # swapped in a singular design
+        optimal_data = build_optimal(4, order=ModelOrder.linear,
+                                     random_state=1797)
+        X = dmatrix(make_model(optimal_data.columns, ModelOrder.linear),
+                    optimal_data)
+        self.assertEqual(5, np.linalg.matrix_rank(X))
+
+        _, stats = build_optimal(3, order=ModelOrder.quadratic, run_count=14,
+                                 refactor_interval=0, random_state=7,
+                                 return_stats=True)
+        self.assertEqual(len(stats[0]['passes']) - 1,
+                         stats[0]['refactorizations'])
+
+        X = np.random.rand(10, 4)
+        XtXi, drift = refactor(X, np.identity(4))
+        np.testing.assert_allclose(np.linalg.inv(np.dot(X.T, X)), XtXi)
+        self.assertGreater(drift, 0)
+
+    def test_report(self):
+        """Tests the per pass callback and the build report."""
+        passes = []
+        optimal_data, report = build_optimal(3, order=ModelOrder.quadratic,
+                                             n_starts=3, random_state=11,
+                                             callback=passes.append,
+                                             return_report=True)
+        self.assertIsInstance(report, OptimalBuildReport)
+        self.assertEqual(3, len(report.starts))
+        self.assertEqual(report.starts[report.best]['value'], report.value)
+
+        trajectory = report.trajectory()
+        self.assertEqual(len(passes), len(trajectory))
+        self.assertEqual([0, 1, 2], sorted(trajectory['start'].unique()))
+        for start, start_passes in trajectory.groupby('start'):
+            stats = report.starts[start]
+            self.assertEqual(list(range(1, len(start_passes) + 1)),
+                             list(start_passes['pass']))
+            self.assertEqual(stats['swaps'], start_passes['swaps'].iloc[-1])
+            self.assertEqual(stats['evals'], start_passes['evals'].iloc[-1])
+            # the criterion only improves, the last pass makes no swaps
+            self.assertTrue(np.all(np.diff(start_passes['value']) <= 1e-9))
+            self.assertAlmostEqual(stats['value'],
+                                   start_passes['value'].iloc[-1])
+            self.assertTrue(np.all(np.diff(start_passes['elapsed']) >= 0))
+
+    def test_limits(self):
+        """Tests stopping a build early on passes, tolerance or time."""
+        _, stats = build_optimal(4, order=ModelOrder.quadratic, run_count=20,
+                                 random_state=3, return_stats=True)
+        self.assertEqual("converged", stats[0]['stopped'])
+        converged = stats[0]['value']
+
+        _, stats = build_optimal(4, order=ModelOrder.quadratic, run_count=20,
+                                 random_state=3, max_passes=1,
+                                 return_stats=True)
+        self.assertEqual("max_passes", stats[0]['stopped'])
+        self.assertEqual(1, len(stats[0]['passes']))
+        self.assertGreaterEqual(stats[0]['value'], converged)
+
+        _, stats = build_optimal(4, order=ModelOrder.quadratic, run_count=20,
+                                 random_state=3, tolerance=1.0,
+                                 return_stats=True)
+        self.assertEqual("tolerance", stats[0]['stopped'])
+        self.assertEqual(1, len(stats[0]['passes']))
+
+        # out of time before any exchanges, the later starts are skipped
+        optimal_data, stats = build_optimal(4, order=ModelOrder.quadratic,
+                                            run_count=20, n_starts=3,
+                                            random_state=3, max_time=0,
+                                            return_stats=True)
+        self.assertEqual(1, len(stats))
+        self.assertEqual("max_time", stats[0]['stopped'])
+        self.assertEqual(0, stats[0]['evals'])
+        self.assertEqual(20, len(optimal_data))
+
+    def test_no_self_exchange(self):
+        """Tests that rounding can't make a level look better than itself.
+
+        Scoring a level against itself used to show a gain of about 1e-15,
+        so this build swapped levels for themselves and never converged.
+        """
+        for criterion in ["D", "I"]:
+            _, stats = build_optimal(4, order=ModelOrder.quadratic,
+                                     random_state=1, criterion=criterion,
+                                     max_passes=30, return_stats=True)
+            self.assertEqual("converged", stats[0]['stopped'])
+
+    def test_random_state(self):
+        """Tests that seeded builds are repeatable and leave numpy alone."""
+        state = np.random.get_state()[1].copy()
+        first = build_optimal(3, order=ModelOrder.quadratic, random_state=8)
+        second = build_optimal(3, order=ModelOrder.quadratic,
+                               random_state=np.random.SeedSequence(8))
+        np.testing.assert_array_equal(first.values, second.values)
+
+        rng = np.random.default_rng(8)
+        build_optimal(3, order=ModelOrder.quadratic, n_starts=2,
+                      random_state=rng)
+        np.testing.assert_array_equal(state, np.random.get_state()[1])
+
+    def test_i_optimal(self):
+        """Tests that an I-optimal design has lower prediction variance."""
+        model = make_model(["X1", "X2", "X3"], ModelOrder.quadratic, True)
+        moments = moment_matrix(["X1", "X2", "X3"], model)
+
+        i_values = {}
+        for criterion in ["D", "I"]:
+            optimal_data = build_optimal(3, model=model, run_count=16,
+                                         criterion=criterion, n_starts=2,
+                                         random_state=1)
+            X = dmatrix(model, optimal_data)
+            XtXi = np.linalg.inv(np.dot(np.transpose(X), X))
+            i_values[criterion] = np.sum(moments * XtXi)
+
+        self.assertLess(i_values["I"], i_values["D"])
+
+    def test_a_optimal(self):
+        """Tests A-optimal and custom criteria against a D-optimal design."""
+        model = make_model(["X1", "X2"], ModelOrder.quadratic, True)
+
+        a_values = {}
+        for criterion in ["D", "A", LOptimality(np.identity(6))]:
+            optimal_data, stats = build_optimal(2, model=model, run_count=8,
+                                                criterion=criterion,
+                                                n_starts=2, random_state=1,
+                                                return_stats=True)
+            X = dmatrix(model, optimal_data)
+            XtXi = np.linalg.inv(np.dot(np.transpose(X), X))
+            a_values[stats[0]['criterion']] = np.trace(XtXi)
+
+        self.assertLess(a_values["A"], a_values["D"])
+        self.assertAlmostEqual(a_values["A"], a_values["L"])
+
+    def test_continuous_search(self):
+        """Tests that a continuous search improves on the grid's design.
+
+        The continuous search polishes the design the grid converges to, so
+        for the same seed it is never worse and only costs the evaluations
+        of the polishing passes.
+        """
+        for seed in range(3):
+            stats = {}
+            for search in ["grid", "continuous"]:
+                _, stats[search] = build_optimal(
+                    6, order=ModelOrder.quadratic, coordinate_search=search,
+                    random_state=seed, return_stats=True)
+            grid = stats["grid"][0]
+            continuous = stats["continuous"][0]
+            self.assertLess(continuous['value'], grid['value'])
+            self.assertGreater(continuous['evals'], grid['evals'])
+            self.assertLess(continuous['evals'], 1.5 * grid['evals'])
+            # the polish starts from the grid's converged design
+            grid_passes = len(grid['passes'])
+            self.assertEqual(grid['evals'],
+                             continuous['passes'][grid_passes - 1]['evals'])
+
+    def test_continuous_fallback(self):
+        """Tests a continuous search on a model that isn't a polynomial."""
+        model = "X1 + X2 + I(1/(X1+2))"
+        optimal_data = build_optimal(2, model=model, run_count=4,
+                                     coordinate_search="continuous",
+                                     random_state=2)
+        X = dmatrix(model, optimal_data)
+        self.assertEqual(4, np.linalg.matrix_rank(X))
+
+        expand = ModelExpander(X.design_info, ["X1", "X2"])
+        self.assertIsNone(polynomial_coefficients(expand, [0.5, 0.5], 0,
+                                                  -1, 1))
+        self.assertIsNotNone(polynomial_coefficients(expand, [0.5, 0.5], 1,
+                                                     -1, 1))
+
+    def test_bad_coordinate_search(self):
+        """Tests that an unknown coordinate search is an error."""
+        with self.assertRaises(ValueError):
+            build_optimal(2, coordinate_search="newton")
+
+    def test_line_polynomials(self):
+        """Tests that the line polynomials match score_change along a line."""
+        model = make_model(["X1", "X2"], ModelOrder.quadratic, True)
+        rng = np.random.default_rng(3)
+        design = pd.DataFrame(rng.uniform(-1, 1, (8, 2)),
+                              columns=["X1", "X2"])
+        X = dmatrix(model, design)
+        expand = ModelExpander(X.design_info, ["X1", "X2"])
+        X = np.asarray(X)
+        XtXi = np.linalg.inv(np.dot(X.T, X))
+
+        t = np.linspace(-1, 1, 7)
+        candidates = np.tile(design.values[2], (len(t), 1))
+        candidates[:, 1] = t
+        coefficients = polynomial_coefficients(expand, design.values[2], 1,
+                                               -1, 1)
+        self.assertEqual(5, len(coefficients))
+
+        for criterion in [DOptimality(), LOptimality(np.identity(6))]:
+            criterion.initialize(XtXi)
+            change = criterion.score_change(XtXi, X[2], expand(candidates))
+            numerator, denominator = criterion.line_polynomials(
+                XtXi, X[2], coefficients)
+            np.testing.assert_allclose(
+                npp.polyval(t, numerator) / npp.polyval(t, denominator),
+                change, atol=1e-10)
+
+    def test_maximize_rational(self):
+        """Tests the exact maximum of a rational function."""
+        # -(t - 0.3)^2 has its maximum inside the interval
+        t, value = maximize_rational([-0.09, 0.6, -1], [1], -1, 1)
+        self.assertAlmostEqual(t, 0.3)
+        self.assertAlmostEqual(value, 0)
+        # t / (1 + t^2) is largest at t = 1
+        t, value = maximize_rational([0, 1], [1, 0, 1], -0.5, 2)
+        self.assertAlmostEqual(t, 1)
+        self.assertAlmostEqual(value, 0.5)
+        # the end of the interval
+        t, value = maximize_rational([0, 1], [1], -1, 1)
+        self.assertAlmostEqual(t, 1)
+
+    def test_moment_matrix(self):
+        """Tests the analytic and sampled moments of a one factor quadratic."""
+        answer = [[1, 0, 1/3], [0, 1/3, 0], [1/3, 0, 1/5]]
+        moments = moment_matrix(["X1"], "X1 + pow(X1, 2)")
+        np.testing.assert_almost_equal(moments, answer)
+
+        # an inverse term diverges over the cube
+        with self.assertRaises(ValueError):
+            moment_matrix(["X1", "X2"], "X1 + X2 + I(1/X1)")
+
+        # products written inside I() are split into their factors
+        model = "X1 + X2 + X1:X2 + pow(X1, 2) + pow(X2, 2)"
+        product_model = "X1 + X2 + I(X1*X2) + I(X1**2) + I(X2**2)"
+        np.testing.assert_almost_equal(moment_matrix(["X1", "X2"], model),
+                                       moment_matrix(["X1", "X2"],
+                                                     product_model))
+        optimal_data = build_optimal(2, model=product_model, criterion="I",
+                                     random_state=1)
+        self.assertEqual(6, len(optimal_data))
+        with self.assertRaises(ValueError):
+            moment_matrix(["X1", "X2"], "X1 + X2 + I((X1 + X2)**2)")
+
+        moments = moment_matrix(["X1"], "X1 + pow(X1, 2)",
+                                constraint_matrix=np.array([[1], [-1]]),
+                                bounds=np.array([1, 1]), sample_count=20000,
+                                random_state=1)
+        np.testing.assert_allclose(moments, answer, atol=0.02)
+
+        # the sampler starts inside a region that excludes the origin
+        moments = moment_matrix(["X1"], "X1",
+                                constraint_matrix=np.array([[1], [-1]]),
+                                bounds=np.array([1, -0.5]), sample_count=5000,
+                                random_state=2)
+        np.testing.assert_allclose(moments, [[1, 0.75], [0.75, 7 / 12]],
+                                   atol=0.02)
+
+        moments = moment_matrix(["X1"], "X1",
+                                constraint_matrix=np.array([[1], [-1]]),
+                                bounds=np.array([1, -0.5]), sample_count=4096,
+                                sampler="sobol", random_state=2)
+        np.testing.assert_allclose(moments, [[1, 0.75], [0.75, 7 / 12]],
+                                   atol=0.002)
+
+        # the default sample count is rounded up to keep Sobol's balance
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            moments = moment_matrix(["X1"], "X1",
+                                    constraint_matrix=np.array([[1], [-1]]),
+                                    bounds=np.array([1, -0.5]),
+                                    sampler="sobol", random_state=2)
+        np.testing.assert_allclose(moments, [[1, 0.75], [0.75, 7 / 12]],
+                                   atol=0.002)
+
+
+class TestAugmentOptimal(TestCase):
+
+    factorial = pd.DataFrame([[-1, -1], [1, -1], [-1, 1], [1, 1]],
+                             columns=["X1", "X2"], dtype=float)
+
+    def test_augment_factorial(self):
+        """Tests adding runs to a factorial to support a quadratic model."""
+        model = make_model(["X1", "X2"], ModelOrder.quadratic, True)
+        augmented, stats = augment_optimal(self.factorial, 4, model,
+                                           random_state=3, return_stats=True)
+
+        self.assertEqual(8, len(augmented))
+        np.testing.assert_array_equal(self.factorial.values,
+                                      augmented.values[:4])
+        self.assertTrue(np.all(np.abs(augmented.values) <= 1))
+
+        X = dmatrix(model, augmented)
+        _, logdet = np.linalg.slogdet(np.linalg.inv(np.dot(np.transpose(X), X)))
+        self.assertAlmostEqual(stats['d_optimality'], logdet)
+
+        # better than adding the same number of random runs
+        random_runs = pd.DataFrame(np.random.uniform(-1, 1, (4, 2)),
+                                   columns=["X1", "X2"])
+        X = dmatrix(model, pd.concat([self.factorial, random_runs]))
+        _, random_logdet = np.linalg.slogdet(
+            np.linalg.inv(np.dot(np.transpose(X), X)))
+        self.assertLess(logdet, random_logdet)
+
+    def test_augment_i_optimal(self):
+        """Tests augmenting to a saturated design on I-optimality."""
+        augmented, stats = augment_optimal(self.factorial, 2, criterion="I",
+                                           coordinate_search="continuous",
+                                           random_state=3, return_stats=True)
+        self.assertEqual(6, len(augmented))
+        self.assertLess(stats['value'], 1.1)
+
+    def test_augment_limits(self):
+        """Tests the search limits when augmenting."""
+        _, stats = augment_optimal(self.factorial, 4, max_passes=1,
+                                   random_state=3, return_stats=True)
+        self.assertEqual(1, len(stats['passes']))
+
+    def test_augment_random_state(self):
+        """Tests that a seeded augmentation is repeatable."""
+        first = augment_optimal(self.factorial, 3, random_state=5)
+        second = augment_optimal(self.factorial, 3,
+                                 random_state=np.random.default_rng(5))
+        np.testing.assert_array_equal(first.values, second.values)
+
+    def test_too_few_runs(self):
+        """Tests augmenting with too few runs to support the model."""
+        with self.assertRaises(ValueError):
+            augment_optimal(self.factorial, 1)
+        with self.assertRaises(ValueError):
+            augment_optimal(self.factorial, 0, "X1 + X2")
+
+
+class TestCandidateOptimal(TestCase):
+
+    def test_four_fac_linear(self):
+        """Tests a 4 factor candidate set design with a linear model.
+
+        This should select 5 corners of the hypercube from the 3^4 grid.
+        """
+        optimal_data = build_candidate_optimal(4, order=ModelOrder.linear)
+
+        model = make_model(optimal_data.columns, ModelOrder.linear, True)
+        X = dmatrix(model, optimal_data)
+        XtXi = np.linalg.inv(np.dot(np.transpose(X), X))
+        d = np.linalg.det(XtXi)
+
+        self.assertAlmostEqual(d, 4.34028E-4, delta=1e-6)
+        np.testing.assert_array_equal(np.abs(optimal_data.values), 1)
+
+    def test_user_candidates(self):
+        """Tests that only points from the candidate set are chosen."""
+        # a constrained region, X1 + X2 <= 0.5
+        grid = np.linspace(-1, 1, 9)
+        candidates = [[x1, x2] for x1 in grid for x2 in grid if x1 + x2 <= 0.5]
+
+        optimal_data = build_candidate_optimal(2, order=ModelOrder.quadratic,
+                                               run_count=8,
+                                               candidates=candidates)
+        self.assertEqual(8, len(optimal_data))
+        for point in optimal_data.values:
+            self.assertTrue(list(point) in candidates)
+
+    def test_too_few_points(self):
+        """Tests a 3 factor candidate set design with insufficient runs."""
+        with self.assertRaises(ValueError):
+            build_candidate_optimal(3, order=ModelOrder.quadratic, run_count=5)
+
+    def test_a_optimal(self):
+        """Tests exchanging candidates on A-optimality rather than D."""
+        model = make_model(get_factor_names(3), ModelOrder.quadratic, True)
+        d_data = build_candidate_optimal(3, model=model, run_count=12,
+                                         random_state=1)
+        a_data = build_candidate_optimal(3, model=model, run_count=12,
+                                         criterion="A", random_state=1)
+
+        def trace(design):
+            X = dmatrix(model, design)
+            return np.trace(np.linalg.inv(np.dot(np.transpose(X), X)))
+
+        self.assertLess(trace(a_data), trace(d_data))
+        for point in a_data.values:
+            self.assertTrue(np.all(np.isin(point, [-1, 0, 1])))
+
+    def test_random_state(self):
+        """Tests that a seeded candidate build is repeatable."""
+        first = build_candidate_optimal(3, order=ModelOrder.quadratic,
+                                        run_count=12, random_state=2)
+        second = build_candidate_optimal(3, order=ModelOrder.quadratic,
+                                         run_count=12, random_state=2)
+        np.testing.assert_array_equal(first.values, second.values)
+
+    def test_bad_criterion(self):
+        """Tests that an unknown criterion is rejected."""
+        with self.assertRaises(ValueError):
+            build_candidate_optimal(2, order=ModelOrder.linear, criterion="E")
@@ -1,6 +1,18 @@
+import os
+import tempfile
 import unittest
 import numpy as np
 from dexpy.samplers import hit_and_run, uniform_simplex_sample
+from dexpy.samplers import check_random_state, spawn_seeds
+from dexpy.samplers import hit_and_run_chains
+from dexpy.samplers import iter_hit_and_run, iter_hit_and_run_chains
+from dexpy.samplers import iter_uniform_simplex_sample
+from dexpy.samplers import remove_redundant_constraints, chebyshev_center
+from dexpy.samplers import round_polytope, sample_polytope
+from dexpy.samplers import ChainDiagnostics
+from dexpy.samplers import low_discrepancy_sample, iter_low_discrepancy_sample
+from dexpy.samplers import low_discrepancy_simplex_sample
+from dexpy.samplers import iter_low_discrepancy_simplex_sample
 
 class TestSimplexSampler(unittest.TestCase):
     """Tests the uniform simplex sampler."""
@@ -24,6 +36,45 @@ class TestSimplexSampler(unittest.TestCase):
         np.testing.assert_approx_equal(result, answer)
 
 
+    @classmethod
+    def test_simplex_sample_random_state(cls):
+        """Tests that a seeded sample is repeatable."""
+        first = uniform_simplex_sample(5, 3, random_state=42)
+        second = uniform_simplex_sample(5, 3, np.random.default_rng(42))
+        np.testing.assert_array_equal(first, second)
+
+
+class TestRandomState(unittest.TestCase):
+    """Tests turning seeds into generators."""
+
+    def test_check_random_state(self):
+        """Tests each kind of seed."""
+        self.assertIs(np.random.mtrand._rand, check_random_state(None))
+        rng = np.random.default_rng(1)
+        self.assertIs(rng, check_random_state(rng))
+        legacy = np.random.RandomState(1)
+        self.assertIs(legacy, check_random_state(legacy))
+        self.assertEqual(np.random.default_rng(7).normal(),
+                         check_random_state(7).normal())
+        seed = np.random.SeedSequence(7)
+        self.assertEqual(np.random.default_rng(seed).normal(),
+                         check_random_state(seed).normal())
+
+    def test_spawn_seeds(self):
+        """Tests that spawned streams are independent and repeatable."""
+        seeds = spawn_seeds(3, 4)
+        self.assertEqual(4, len(seeds))
+        draws = [np.random.default_rng(seed).normal() for seed in seeds]
+        self.assertEqual(4, len(set(draws)))
+
+        again = [np.random.default_rng(seed).normal()
+                 for seed in spawn_seeds(3, 4)]
+        self.assertEqual(draws, again)
+
+        for rng in [np.random.default_rng(5), np.random.RandomState(5)]:
+            self.assertEqual(2, len(spawn_seeds(rng, 2)))
+
+
 class TestHitAndRunSquare(unittest.TestCase):
     """Tests the hit and run sampler over [0, 1] x [0, 1]."""
 
@@ -48,7 +99,7 @@ class TestHitAndRunSquare(unittest.TestCase):
     def test_hit_and_run_2(self):
         """Tests generation of a single point with thin = 3."""
         result = hit_and_run(self.x0, self.A, self.bounds, 1, 3)
-        answer = np.array([[0.32222719, 0.10867805]])
+        answer = np.array([[0.79310167, 0.10867805]])
         np.testing.assert_almost_equal(result, answer)
 
 
@@ -60,14 +111,43 @@ class TestHitAndRunSquare(unittest.TestCase):
         np.testing.assert_almost_equal(result, answer)
 
 
+    def test_hit_and_run_random_state(self):
+        """Tests that a generator leaves the global random state alone."""
+        state = np.random.get_state()[1].copy()
+        first = hit_and_run(self.x0, self.A, self.bounds, 3, 2,
+                            random_state=np.random.default_rng(9))
+        second = hit_and_run(self.x0, self.A, self.bounds, 3, 2,
+                             random_state=9)
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_array_equal(state, np.random.get_state()[1])
+
     def test_hit_and_run_4(self):
         """Tests generation of 3 points with thin = 3."""
         result = hit_and_run(self.x0, self.A, self.bounds, 2, 3)
-        answer = np.array([[0.32222719, 0.10867805],
-                           [0.30750317, 0.05997018]])
+        answer = np.array([[0.79310167, 0.10867805],
+                           [0.10028575, 0.05997018]])
         np.testing.assert_almost_equal(result, answer)
 
 
+    def test_hit_and_run_burn_in(self):
+        """Tests that burn in discards the first steps of the chain."""
+        result = hit_and_run(self.x0, self.A, self.bounds, 2, 1)
+        np.random.seed(100)
+        burned = hit_and_run(self.x0, self.A, self.bounds, 1, 1, burn_in=1)
+        np.testing.assert_almost_equal(result[1:], burned)
+
+    def test_hit_and_run_resync(self):
+        """Tests that the tracked slack matches resyncing every step."""
+        result = hit_and_run(self.x0, self.A, self.bounds, 50, 2)
+        np.random.seed(100)
+        exact = hit_and_run(self.x0, self.A, self.bounds, 50, 2,
+                            resync_interval=1)
+        np.testing.assert_allclose(result, exact, atol=1e-12)
+
+        with self.assertRaises(ValueError):
+            hit_and_run(self.x0, self.A, self.bounds, 5, resync_interval=0)
+
+
 class TestHitAndRunConstrained(unittest.TestCase):
     """Tests the hit and run sampler over [0, 1] x [0, 1].
 
@@ -112,3 +192,320 @@ class TestHitAndRunOneDimension(unittest.TestCase):
                            [0.59920946]])
         np.testing.assert_almost_equal(result, answer)
 
+
+
+class TestHitAndRunChains(unittest.TestCase):
+    """Tests the multi-chain hit and run sampler."""
+
+    def setUp(self):
+        # [0, 1] x [0, 1] with x1 + x2 >= 0.9
+        self.A = np.array([[1, 0],
+                           [0, 1],
+                           [-1, 0],
+                           [0, -1],
+                           [-1, -1]])
+        self.bounds = np.array([1, 1, 0, 0, -0.9])
+        self.x0 = np.tile([0.5, 0.5], (50, 1))
+
+    def test_chains_feasible(self):
+        """Tests that every chain stays in the region."""
+        result = hit_and_run_chains(self.x0, self.A, self.bounds, 20,
+                                    thin=2, random_state=1)
+        self.assertEqual((20, 50, 2), result.shape)
+
+        points = result.reshape(-1, 2)
+        slack = self.bounds - np.dot(points, self.A.T)
+        self.assertTrue(np.all(slack >= -1e-12))
+        # the chains don't move together
+        self.assertEqual(50, len(np.unique(result[-1, :, 0])))
+
+    def test_chains_uniform(self):
+        """Tests that the chains sample the unit square uniformly."""
+        A = self.A[:4]
+        bounds = self.bounds[:4]
+        result = hit_and_run_chains(self.x0, A, bounds, 200, random_state=2)
+        points = result[20:].reshape(-1, 2)
+        np.testing.assert_allclose(points.mean(axis=0), [0.5, 0.5], atol=0.01)
+        np.testing.assert_allclose(points.var(axis=0), [1 / 12, 1 / 12],
+                                   atol=0.005)
+
+    def test_chains_burn_in(self):
+        """Tests burn in and thinning for the chains."""
+        result = hit_and_run_chains(self.x0, self.A, self.bounds, 4, thin=2,
+                                    random_state=4)
+        burned = hit_and_run_chains(self.x0, self.A, self.bounds, 1, thin=2,
+                                    burn_in=6, random_state=4)
+        np.testing.assert_allclose(result[3:], burned, atol=1e-12)
+
+    def test_one_chain(self):
+        """Tests a single starting point and reproducibility."""
+        first = hit_and_run_chains([0.5, 0.5], self.A, self.bounds, 5,
+                                   random_state=3)
+        second = hit_and_run_chains([0.5, 0.5], self.A, self.bounds, 5,
+                                    random_state=np.random.default_rng(3))
+        self.assertEqual((5, 1, 2), first.shape)
+        np.testing.assert_array_equal(first, second)
+
+        # the single chain sampler steps the same chain in 1-D
+        single = hit_and_run([0.5, 0.5], self.A, self.bounds, 5, thin=3,
+                             random_state=3)
+        chains = hit_and_run_chains([0.5, 0.5], self.A, self.bounds, 5,
+                                    thin=3, random_state=3)
+        np.testing.assert_allclose(single, chains[:, 0], atol=1e-12)
+
+
+class TestStreamingSamplers(unittest.TestCase):
+    """Tests the chunked versions of the samplers."""
+
+    def setUp(self):
+        self.A = np.array([[1, 0],
+                           [0, 1],
+                           [-1, 0],
+                           [0, -1]])
+        self.bounds = np.array([1, 1, 0, 0])
+
+    def test_simplex_chunks(self):
+        """Tests that the chunks make up the same sample."""
+        sample = uniform_simplex_sample(25, 3, random_state=1)
+        chunks = list(iter_uniform_simplex_sample(25, 3, 10, random_state=1))
+        self.assertEqual([10, 10, 5], [len(c) for c in chunks])
+        np.testing.assert_allclose(sample, np.vstack(chunks))
+
+    def test_hit_and_run_chunks(self):
+        """Tests that the chunks continue the same chain."""
+        sample = hit_and_run([0.5, 0.5], self.A, self.bounds, 25, thin=2,
+                             random_state=2, burn_in=3)
+        chunks = list(iter_hit_and_run([0.5, 0.5], self.A, self.bounds, 25,
+                                       chunk_size=10, thin=2, random_state=2,
+                                       burn_in=3))
+        self.assertEqual([10, 10, 5], [len(c) for c in chunks])
+        np.testing.assert_array_equal(sample, np.vstack(chunks))
+
+        x0 = np.tile([0.5, 0.5], (4, 1))
+        sample = hit_and_run_chains(x0, self.A, self.bounds, 7,
+                                    random_state=3)
+        chunks = list(iter_hit_and_run_chains(x0, self.A, self.bounds, 7,
+                                              chunk_size=3, random_state=3))
+        self.assertEqual((3, 4, 2), chunks[0].shape)
+        np.testing.assert_array_equal(sample, np.concatenate(chunks))
+
+    def test_memmap(self):
+        """Tests streaming the sample into a memory mapped file."""
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            out = np.memmap(path, dtype=float, mode='w+', shape=(30, 2))
+            for chunk in iter_hit_and_run([0.5, 0.5], self.A, self.bounds,
+                                          30, chunk_size=8, random_state=4,
+                                          out=out):
+                self.assertIsInstance(chunk, np.memmap)
+            out.flush()
+            del out
+
+            stored = np.memmap(path, dtype=float, mode='r', shape=(30, 2))
+            sample = hit_and_run([0.5, 0.5], self.A, self.bounds, 30,
+                                 random_state=4)
+            np.testing.assert_array_equal(sample, stored)
+            del stored
+        finally:
+            os.remove(path)
+
+    def test_bad_out(self):
+        """Tests an output array of the wrong shape."""
+        with self.assertRaises(ValueError):
+            list(iter_uniform_simplex_sample(10, 3, out=np.zeros((10, 2))))
+
+
+class TestPolytopePreprocessing(unittest.TestCase):
+    """Tests preparing a polytope for hit and run."""
+
+    def setUp(self):
+        # [0, 1] x [0, 1] with x1 + x2 >= 0.9, a redundant x1 + x2 <= 3 and a
+        # repeated x1 <= 1
+        self.A = np.array([[1, 0],
+                           [0, 1],
+                           [-1, 0],
+                           [0, -1],
+                           [-1, -1],
+                           [1, 1],
+                           [1, 0]])
+        self.bounds = np.array([1, 1, 0, 0, -0.9, 3, 1])
+
+    def test_remove_redundant(self):
+        """Tests that only the needed constraints are kept."""
+        A, bounds = remove_redundant_constraints(self.A, self.bounds)
+        self.assertEqual(5, len(A))
+        self.assertEqual(5, len(bounds))
+        self.assertEqual(0, np.sum(np.all(A == [1, 1], axis=1)))
+        self.assertEqual(1, np.sum(np.all(A == [1, 0], axis=1)))
+        # the kept constraints are all needed, e.g. x1 >= 0 cuts off the
+        # corner of x1 + x2 >= 0.9 at x1 = -0.1
+        A, bounds = remove_redundant_constraints(A, bounds)
+        self.assertEqual(5, len(A))
+
+        # with x1 + x2 >= 1.1 and both at most 1, x1 >= 0.1 and x2 >= 0.1,
+        # so x1 >= 0 and x2 >= 0 are implied
+        bounds = np.array(self.bounds, dtype=float)
+        bounds[4] = -1.1
+        A, bounds = remove_redundant_constraints(self.A, bounds)
+        self.assertEqual(3, len(A))
+        self.assertEqual(0, np.sum(np.all(A == [-1, 0], axis=1)))
+        self.assertEqual(0, np.sum(np.all(A == [0, -1], axis=1)))
+        self.assertEqual(1, np.sum(np.all(A == [-1, -1], axis=1)))
+
+    def test_chebyshev_center(self):
+        """Tests the center of a square and errors for bad regions."""
+        center, radius = chebyshev_center(self.A[:4], self.bounds[:4])
+        np.testing.assert_allclose(center, [0.5, 0.5])
+        self.assertAlmostEqual(0.5, radius)
+
+        center, radius = chebyshev_center(self.A, self.bounds)
+        slack = self.bounds - np.dot(self.A, center)
+        self.assertTrue(np.all(slack >= radius * np.linalg.norm(self.A, axis=1)
+                               - 1e-9))
+
+        with self.assertRaises(ValueError):
+            chebyshev_center([[1, 0], [0, 1]], [1, 1])
+        with self.assertRaises(ValueError):
+            chebyshev_center([[1], [-1]], [-1, 0])
+
+    def test_rounding(self):
+        """Tests sampling a long thin box after rounding it."""
+        A = np.array([[1, 0], [-1, 0], [0, 1], [0, -1]])
+        bounds = np.array([100, 0, 1, 0])
+        center, _ = chebyshev_center(A, bounds)
+
+        rounded, rounded_bounds, transform = round_polytope(
+            A, bounds, center, random_state=5)
+        self.assertTrue(np.all(rounded_bounds > 0))
+        self.assertGreater(transform[0, 0] / transform[1, 1], 10)
+
+        sample = sample_polytope(A, bounds, 2000, rounding=True,
+                                 random_state=6)
+        slack = bounds - np.dot(sample, A.T)
+        self.assertTrue(np.all(slack >= -1e-9))
+        np.testing.assert_allclose(sample.mean(axis=0), [50, 0.5], rtol=0.1)
+
+    def test_sample_polytope(self):
+        """Tests sampling without an explicit starting point."""
+        sample = sample_polytope(self.A, self.bounds, 100, random_state=7)
+        self.assertEqual((100, 2), sample.shape)
+        slack = self.bounds - np.dot(sample, self.A.T)
+        self.assertTrue(np.all(slack >= -1e-9))
+
+
+class TestChainDiagnostics(unittest.TestCase):
+    """Tests the online sampler diagnostics."""
+
+    def test_autoregressive(self):
+        """Tests the diagnostics of known autoregressive chains."""
+        rng = np.random.default_rng(0)
+        phi = np.array([0.9, 0])
+        diagnostics = ChainDiagnostics(4, 2, max_lag=2)
+        x = 100 + rng.normal(size=(4, 2)) / np.sqrt(1 - phi ** 2)
+        for _ in range(20000):
+            x = 100 + phi * (x - 100) + rng.normal(size=(4, 2))
+            diagnostics.update(x)
+
+        self.assertTrue(diagnostics.ready)
+        np.testing.assert_allclose(diagnostics.autocorrelation(),
+                                   [[0.9, 0], [0.81, 0]], atol=0.02)
+        # n (1 - phi) / (1 + phi)
+        np.testing.assert_allclose(diagnostics.effective_sample_size(),
+                                   [80000 / 19, 80000], rtol=0.2)
+        np.testing.assert_allclose(diagnostics.split_rhat(), [1, 1],
+                                   atol=0.01)
+
+    def test_unmixed_chains(self):
+        """Tests that chains in different places have a large R-hat."""
+        rng = np.random.default_rng(1)
+        diagnostics = ChainDiagnostics(2, 1)
+        for _ in range(2000):
+            diagnostics.update(rng.normal(size=(2, 1)) + [[0], [3]])
+        self.assertGreater(diagnostics.split_rhat()[0], 1.5)
+        self.assertLess(diagnostics.effective_sample_size()[0], 500)
+        self.assertFalse(diagnostics.converged(500))
+
+    def test_unmixed_chains_continue(self):
+        """Tests that chains that mix apart don't stop the sampler early."""
+        rng = np.random.default_rng(5)
+        mixed = ChainDiagnostics(2, 1)
+        unmixed = ChainDiagnostics(2, 1)
+        for _ in range(2000):
+            x = rng.normal(size=(2, 1))
+            mixed.update(x)
+            unmixed.update(x + [[0], [5]])
+        # each chain alone has an effective sample size of about 2000
+        self.assertTrue(mixed.converged(1000))
+        self.assertGreater(unmixed.split_rhat()[0], 1.5)
+        self.assertFalse(unmixed.converged(1000))
+
+    def test_target_ess(self):
+        """Tests stopping the sampler at a target effective sample size."""
+        A = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+        bounds = np.array([1, 1, 0, 0])
+        x0 = np.tile([0.5, 0.5], (4, 1))
+
+        diagnostics = ChainDiagnostics(4, 2)
+        sample = hit_and_run_chains(x0, A, bounds, 100000, random_state=2,
+                                    diagnostics=diagnostics, target_ess=2000)
+        self.assertLess(len(sample), 100000)
+        self.assertEqual(len(sample), diagnostics.n)
+        self.assertTrue(np.all(diagnostics.effective_sample_size() >= 2000))
+
+        diagnostics = ChainDiagnostics(1, 2)
+        sample = hit_and_run([0.5, 0.5], A, bounds, 100000, random_state=3,
+                             diagnostics=diagnostics, target_ess=500)
+        self.assertLess(len(sample), 100000)
+
+        with self.assertRaises(ValueError):
+            hit_and_run_chains(x0, A, bounds, 10, target_ess=100)
+        with self.assertRaises(ValueError):
+            hit_and_run([0.5, 0.5], A, bounds, 10, target_ess=100)
+        with self.assertRaises(ValueError):
+            iter_hit_and_run([0.5, 0.5], A, bounds, 10, target_ess=100)
+
+
+class TestLowDiscrepancySamplers(unittest.TestCase):
+    """Tests the quasi-random samplers."""
+
+    def test_cube(self):
+        """Tests that the cube sample is even and repeatable."""
+        for method in ["sobol", "halton"]:
+            sample = low_discrepancy_sample(1024, 3, method, random_state=1)
+            self.assertEqual((1024, 3), sample.shape)
+            self.assertTrue(np.all(np.abs(sample) <= 1))
+            # much closer to the moments of the cube than a random sample
+            np.testing.assert_allclose(sample.mean(axis=0), 0, atol=0.005)
+            np.testing.assert_allclose(np.mean(sample ** 2, axis=0), 1 / 3,
+                                       atol=0.005)
+
+            again = low_discrepancy_sample(1024, 3, method, random_state=1)
+            np.testing.assert_array_equal(sample, again)
+
+        with self.assertRaises(ValueError):
+            low_discrepancy_sample(16, 2, "lattice")
+
+    def test_cube_chunks(self):
+        """Tests that the chunks continue the same sequence."""
+        sample = low_discrepancy_sample(64, 2, random_state=2)
+        chunks = list(iter_low_discrepancy_sample(64, 2, 16, random_state=2))
+        self.assertEqual(4, len(chunks))
+        np.testing.assert_array_equal(sample, np.vstack(chunks))
+
+    def test_simplex(self):
+        """Tests that the simplex sample is uniform over the simplex."""
+        sample = low_discrepancy_simplex_sample(4096, 3, random_state=3)
+        self.assertEqual((4096, 3), sample.shape)
+        np.testing.assert_allclose(sample.sum(axis=1), 1)
+        self.assertTrue(np.all(sample >= 0))
+        # each component is Beta(1, 2)
+        np.testing.assert_allclose(sample.mean(axis=0), 1 / 3, atol=0.002)
+        np.testing.assert_allclose(np.var(sample, axis=0), 1 / 18, atol=0.002)
+
+        chunks = list(iter_low_discrepancy_simplex_sample(4096, 3, 1024,
+                                                          random_state=3))
+        np.testing.assert_array_equal(sample, np.vstack(chunks))
+
+        np.testing.assert_array_equal(
+            np.ones((2, 1)), low_discrepancy_simplex_sample(2, 1))
@@ -16,7 +16,6 @@ CLASSIFIERS = [
     "Intended Audience :: Science/Research",
     "License :: OSI Approved :: Apache Software License",
     "Programming Language :: Python",
-    "Programming Language :: Python :: 2",
     "Programming Language :: Python :: 3",
     "Topic :: Scientific/Engineering :: Mathematics",
 ]
@@ -34,7 +33,8 @@ def run_setup():
         url='https://statease.github.io/dexpy/',
         download_url = 'https://github.com/statease/dexpy/releases',
         packages=['dexpy', 'dexpy.tests'],
-        install_requires=['numpy', 'patsy', 'pandas', 'scipy'],
+        python_requires='>=3.7',
+        install_requires=['numpy>=1.17', 'patsy', 'pandas', 'scipy>=1.7'],
     )
 
 run_setup()